@@ -0,0 +1,44 @@
+import hashlib
+import re
+import zlib
+
+PLACEHOLDER_RE = re.compile(r"\{\{\s*(\w+)\s*\}\}")  # same syntax as send_emails.py
+COMPRESS_LEVEL = 6
+
+
+def body_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def compress(text):
+    return zlib.compress(text.encode("utf-8"), COMPRESS_LEVEL)
+
+
+def decompress(blob):
+    return zlib.decompress(blob).decode("utf-8")
+
+
+def template_variables(recipient):
+    """The values send_emails.py substitutes for a recipient: {{user}}, {{email}}, {{domain}}."""
+    user, _, domain = (recipient or "").partition("@")
+    return {"user": user, "email": recipient, "domain": domain}
+
+
+def render_template(html, values):
+    """Substitute ``{{name}}`` placeholders; ones without a value are left as they are."""
+    return PLACEHOLDER_RE.sub(
+        lambda m: str(values[m.group(1)]) if m.group(1) in values else m.group(0), html
+    )
+
+
+def match_template(body, template_html, recipient):
+    """Return the variables that render ``template_html`` into ``body``, or None.
+
+    Line endings are compared normalised, since delivery rewrites CRLF to LF.
+    """
+    values = template_variables(recipient)
+    used = {name: values[name] for name in PLACEHOLDER_RE.findall(template_html) if name in values}
+    rendered = render_template(template_html, used)
+    if rendered.replace("\r\n", "\n") != body.replace("\r\n", "\n"):
+        return None
+    return used
@@ -1,15 +1,14 @@
-import requests, time
+from generation import RemoteModelClient, wait_for_result
 
-SERVER = "https://puspeshd.pythonanywhere.com"
+model = RemoteModelClient()
 
 prompt = input("Enter prompt: ")
-requests.post(f"{SERVER}/send_prompt", json={"prompt": prompt})
+model.send(prompt)
 print("Prompt sent ✅")
 
-while True:
-    res = requests.get(f"{SERVER}/get_result").json()
-    if res["result"] != "pending":
-        print("Model response:")
-        print(res["result"])
-        break
-    time.sleep(3)
+try:
+    result = wait_for_result(model)
+    print("Model response:")
+    print(result)
+except TimeoutError as e:
+    print(f"❌ {e}")
@@ -0,0 +1,792 @@
+import base64
+import functools
+import json
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from bodies import body_hash, compress, decompress, match_template, render_template
+from metrics import REGISTRY
+
+DB_PATH = os.environ.get("EMAIL_LOGS_DB", "email_logs.db")
+
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",        # readers never block the writer
+    "PRAGMA synchronous = NORMAL",      # safe with WAL, fsyncs only at checkpoints
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -32000",       # ~32 MB page cache per connection
+    "PRAGMA mmap_size = 268435456",
+)
+
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 8))  # idle connections kept for reuse
+
+_local = threading.local()
+_idle = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+
+DB_WRITE_SECONDS = REGISTRY.histogram("db_write_seconds", "SQLite write transaction time", ("op",))
+
+
+def _open_connection():
+    conn = sqlite3.connect(DB_PATH, timeout=30, check_same_thread=False)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def get_connection():
+    """Return this thread's connection, checking one out of the pool on first use.
+
+    Long-lived threads keep theirs; request threads hand it back with
+    ``release_connection()`` so the next request skips the connect and PRAGMAs.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        try:
+            conn = _idle.get_nowait()
+        except queue.Empty:
+            conn = _open_connection()
+        _local.conn = conn
+    return conn
+
+
+def release_connection(exc=None):
+    """Return this thread's connection to the pool; usable as a Flask teardown hook."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        return
+    _local.conn = None
+    if conn.in_transaction:
+        conn.rollback()
+    try:
+        _idle.put_nowait(conn)
+    except queue.Full:
+        conn.close()
+
+
+@contextmanager
+def transaction():
+    """Run a block of statements in one transaction on this thread's connection."""
+    conn = get_connection()
+    conn.execute("BEGIN")
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+# --- Schema migrations ---------------------------------------------------
+# Each migration runs once, in order, inside its own transaction; the schema
+# version is tracked in PRAGMA user_version.
+
+def _columns(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def _migration_baseline(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS email_logs (
+            container_id TEXT,
+            recipient TEXT,
+            subject TEXT,
+            status TEXT,
+            timestamp REAL,
+            body_snippet TEXT,
+            body_html TEXT,
+            PRIMARY KEY (container_id, recipient, subject, timestamp)
+        )
+    ''')
+    # Databases created before body_html existed
+    if "body_html" not in _columns(conn, "email_logs"):
+        conn.execute("ALTER TABLE email_logs ADD COLUMN body_html TEXT")
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS email_templates (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE,
+            design_json TEXT,
+            html TEXT,
+            created_at REAL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS maildir_cursor (
+            container_id TEXT,
+            user TEXT,
+            filename TEXT,
+            PRIMARY KEY (container_id, user, filename)
+        )
+    ''')
+
+
+def _migration_email_log_indexes(conn):
+    # Serves both COUNT(*) per container and the newest-first listing
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_email_logs_container_time
+        ON email_logs (container_id, timestamp DESC)
+    ''')
+
+
+def _migration_body_blobs(conn):
+    # Bodies are stored once, compressed and keyed by content hash. When
+    # template_vars is set, body_hash names a template's HTML instead and the
+    # body is that template rendered with the variables.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS email_bodies (
+            hash TEXT PRIMARY KEY,
+            body BLOB NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    columns = _columns(conn, "email_logs")
+    for column, kind in (("body_hash", "TEXT"), ("template_vars", "TEXT")):
+        if column not in columns:
+            conn.execute(f"ALTER TABLE email_logs ADD COLUMN {column} {kind}")
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_email_logs_body_hash
+        ON email_logs (body_hash) WHERE body_hash IS NOT NULL
+    ''')
+    last_rowid = 0
+    while True:
+        rows = conn.execute(
+            "SELECT rowid, recipient, subject, body_html FROM email_logs "
+            "WHERE rowid > ? AND body_html != '' ORDER BY rowid LIMIT 500", (last_rowid,)
+        ).fetchall()
+        if not rows:
+            break
+        last_rowid = rows[-1][0]
+        refs = _store_bodies(conn, [{"to": r[1], "subject": r[2], "body_html": r[3]} for r in rows])
+        conn.executemany("UPDATE email_logs SET body_hash = ?, template_vars = ?, body_html = NULL WHERE rowid = ?",
+                         [(*ref, r[0]) for ref, r in zip(refs, rows)])
+    conn.execute("UPDATE email_logs SET body_html = NULL WHERE body_html = ''")
+
+
+def _migration_template_versions(conn):
+    if "updated_at" not in _columns(conn, "email_templates"):
+        conn.execute("ALTER TABLE email_templates ADD COLUMN updated_at REAL")
+    conn.execute("UPDATE email_templates SET updated_at = created_at WHERE updated_at IS NULL")
+
+
+def _migration_postfix_log(conn):
+    # Delivery attempts parsed from each container's Postfix log
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS postfix_log (
+            container_id TEXT NOT NULL,
+            timestamp REAL NOT NULL,
+            queue_id TEXT NOT NULL,
+            recipient TEXT,
+            status TEXT,
+            delay REAL,
+            dsn TEXT,
+            relay TEXT,
+            detail TEXT
+        )
+    ''')
+    # Doubles as the queue id lookup and as the dedup key for replayed log lines
+    conn.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_postfix_log_queue
+        ON postfix_log (container_id, queue_id, recipient, timestamp, status)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_postfix_log_time
+        ON postfix_log (container_id, timestamp DESC)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_postfix_log_recipient
+        ON postfix_log (container_id, recipient, timestamp DESC)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_postfix_log_status
+        ON postfix_log (container_id, status, timestamp DESC)
+    ''')
+
+
+def _migration_delivery_reconciliation(conn):
+    # Sender records carry the queue id from the DATA reply, Maildir records the
+    # queue id and envelope recipient from their headers; reconcile_deliveries()
+    # fills final_status/delivered_at/delivery_latency on the sender records.
+    columns = _columns(conn, "email_logs")
+    for column, kind in (("source", "TEXT"), ("queue_id", "TEXT"), ("delivered_to", "TEXT"),
+                         ("final_status", "TEXT"), ("delivered_at", "REAL"), ("delivery_latency", "REAL")):
+        if column not in columns:
+            conn.execute(f"ALTER TABLE email_logs ADD COLUMN {column} {kind}")
+    # Until now fetch_mail_data was the only writer, so existing rows are Maildir harvests
+    conn.execute("UPDATE email_logs SET source = 'maildir' WHERE source IS NULL")
+    # Sender records still waiting for an outcome, per container
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_email_logs_delivery
+        ON email_logs (container_id, final_status)
+        WHERE source = 'sender' AND queue_id IS NOT NULL
+    ''')
+    # Maildir arrivals by (queue id, envelope recipient)
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_email_logs_arrival
+        ON email_logs (queue_id, delivered_to, container_id, timestamp)
+        WHERE delivered_to IS NOT NULL
+    ''')
+
+
+def _migration_maildir_keys(conn):
+    # The (container_id, recipient, subject, timestamp) primary key let Maildir
+    # arrivals overwrite each other, since they share To: headers and
+    # whole-second timestamps. The table is rebuilt without it, rowids kept.
+    # Sender records keep that key as a unique index; Maildir arrivals are
+    # unique by their Maildir file instead.
+    indexes = [r[0] for r in conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = 'email_logs' AND sql IS NOT NULL")]
+    columns = ", ".join((
+        "container_id", "recipient", "subject", "status", "timestamp", "body_snippet", "body_html",
+        "body_hash", "template_vars", "source", "queue_id", "delivered_to",
+        "final_status", "delivered_at", "delivery_latency",
+    ))
+    conn.execute('''
+        CREATE TABLE email_logs_new (
+            container_id TEXT,
+            recipient TEXT,
+            subject TEXT,
+            status TEXT,
+            timestamp REAL,
+            body_snippet TEXT,
+            body_html TEXT,
+            body_hash TEXT,
+            template_vars TEXT,
+            source TEXT,
+            queue_id TEXT,
+            delivered_to TEXT,
+            final_status TEXT,
+            delivered_at REAL,
+            delivery_latency REAL,
+            maildir_file TEXT
+        )
+    ''')
+    conn.execute(f"INSERT INTO email_logs_new (rowid, {columns}) SELECT rowid, {columns} FROM email_logs")
+    conn.execute("DROP TABLE email_logs")
+    conn.execute("ALTER TABLE email_logs_new RENAME TO email_logs")
+    for sql in indexes:
+        conn.execute(sql)
+    conn.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_email_logs_record
+        ON email_logs (container_id, recipient, subject, timestamp)
+        WHERE maildir_file IS NULL
+    ''')
+    conn.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_email_logs_maildir_file
+        ON email_logs (container_id, maildir_file)
+        WHERE maildir_file IS NOT NULL
+    ''')
+
+
+def _migration_sent_count_index(conn):
+    # "Sent" counts cover accepted sender records only: not harvested Maildir arrivals
+    # of the same messages, nor the failure and deferral rows a retried message leaves
+    conn.execute("DROP INDEX IF EXISTS idx_email_logs_sent")
+    conn.execute('''
+        CREATE INDEX idx_email_logs_sent
+        ON email_logs (container_id) WHERE source = 'sender' AND status = 'success'
+    ''')
+
+
+MIGRATIONS = [
+    _migration_baseline,
+    _migration_email_log_indexes,
+    _migration_body_blobs,
+    _migration_template_versions,
+    _migration_postfix_log,
+    _migration_delivery_reconciliation,
+    _migration_maildir_keys,
+    _migration_sent_count_index,
+]
+
+
+def migrate(conn):
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        conn.execute("BEGIN")
+        try:
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {number}")
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+
+def init_db():
+    migrate(get_connection())
+
+
+# --- email_bodies ----------------------------------------------------------
+
+def _store_bodies(conn, records):
+    """Store the bodies of ``records`` and return a (body_hash, template_vars) pair for each.
+
+    Sender records name their template by id (``template_id``/``template_vars``)
+    and the version they rendered. If that isn't the current version, the HTML
+    the sender shipped (``template_html``) or the stored blob matching
+    ``template_hash`` is used instead; failing both the record gets no body
+    rather than the wrong one. A harvested ``body_html`` that is exactly the
+    template named by its subject rendered for its recipient is kept as that
+    template plus variables. Anything else is stored whole. Records without a
+    body get (None, None).
+    """
+    templates = versions = None
+    blobs = {}
+    refs = []
+    stored_refs = {}  # index in refs -> hash of an older template version, if it is stored
+    for record in records:
+        html = variables = None
+        if record.get("template_vars") is not None and record.get("template_id") is not None:
+            if versions is None:
+                versions = {str(r[0]): (r[1], r[2], body_hash(r[1]) if r[1] else None) for r in conn.execute(
+                    "SELECT id, html, updated_at FROM email_templates")}
+            current_html, current_version, current_hash = versions.get(str(record["template_id"]), (None,) * 3)
+            variables = record["template_vars"]
+            # Records logged before versions were sent carry none; trust the current HTML
+            if ("template_updated_at" not in record or record["template_updated_at"] == current_version
+                    or record.get("template_hash") == current_hash):
+                html = current_html
+            elif record.get("template_html"):
+                html = record["template_html"]
+            elif record.get("template_hash"):
+                stored_refs[len(refs)] = record["template_hash"]
+                refs.append((record["template_hash"], json.dumps(variables, sort_keys=True)))
+                continue
+        elif record.get("body_html"):
+            if templates is None:
+                templates = conn.execute("SELECT id, name, html FROM email_templates ORDER BY id").fetchall()
+            html = next((t[2] for t in templates if t[1] == record.get("subject") and t[2]), None)
+            variables = match_template(record["body_html"], html, record.get("to")) if html else None
+            if variables is None:
+                html = record["body_html"]
+        if html is None:
+            refs.append((None, None))
+            continue
+        digest = body_hash(html)
+        blobs.setdefault(digest, html)
+        refs.append((digest, json.dumps(variables, sort_keys=True) if variables is not None else None))
+
+    known = set()
+    digests = list(blobs.keys() | set(stored_refs.values()))
+    for i in range(0, len(digests), 500):
+        chunk = digests[i:i + 500]
+        known.update(r[0] for r in conn.execute(
+            f"SELECT hash FROM email_bodies WHERE hash IN ({','.join('?' * len(chunk))})", chunk))
+    conn.executemany("INSERT OR IGNORE INTO email_bodies (hash, body) VALUES (?, ?)",
+                     [(digest, compress(text)) for digest, text in blobs.items() if digest not in known])
+    for i, digest in stored_refs.items():
+        if digest not in known and digest not in blobs:
+            refs[i] = (None, None)
+    return refs
+
+
+@functools.lru_cache(maxsize=64)
+def _load_blob(digest):
+    # Content-addressed blobs never change, so caching them is always safe.
+    # A missing blob raises, which lru_cache does not remember.
+    row = get_connection().execute("SELECT body FROM email_bodies WHERE hash = ?", (digest,)).fetchone()
+    if row is None:
+        raise KeyError(digest)
+    return decompress(row[0])
+
+
+def _load_body(digest, template_vars):
+    if digest is None:
+        return ''
+    try:
+        stored = _load_blob(digest)
+    except KeyError:
+        return ''
+    if template_vars is None:
+        return stored
+    return render_template(stored, json.loads(template_vars))
+
+
+# --- email_logs ------------------------------------------------------------
+
+@DB_WRITE_SECONDS.timed(op="save_email_logs")
+def save_email_logs_to_db(container_id, logs, source="sender"):
+    """Store sender records, or Maildir arrivals with ``source="maildir"``.
+
+    Sender records replace an earlier copy with the same recipient, subject and
+    timestamp; Maildir arrivals one with the same ``maildir_file``.
+    """
+    with transaction() as conn:
+        refs = _store_bodies(conn, logs)
+        conn.executemany('''
+            INSERT OR REPLACE INTO email_logs
+            (container_id, recipient, subject, status, timestamp, body_snippet, body_hash, template_vars,
+             source, queue_id, delivered_to, maildir_file)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [
+            (
+                container_id,
+                record.get('to'),
+                record.get('subject'),
+                record.get('status'),
+                record.get('timestamp'),
+                record.get('body_snippet') or '',
+                *ref,
+                source,
+                record.get('queue_id'),
+                record.get('delivered_to'),
+                record.get('maildir_file')
+            )
+            for record, ref in zip(logs, refs)
+        ])
+
+
+EMAIL_LOG_COLUMNS = ("rowid, recipient, subject, status, timestamp, body_snippet, "
+                     "queue_id, final_status, delivered_at, delivery_latency")
+
+
+def _email_log_row(r, include_body):
+    log = {
+        "id": r[0],
+        "to": r[1],
+        "subject": r[2],
+        "status": r[3],
+        "timestamp": r[4],
+        "body_snippet": r[5],
+        "queue_id": r[6],
+        "final_status": r[7],
+        "delivered_at": r[8],
+        "delivery_latency": r[9]
+    }
+    if include_body:
+        log["body_html"] = _load_body(r[10], r[11])
+    return log
+
+
+def _escape_like(value):
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _email_log_where(container_id, filters):
+    """WHERE clauses and parameters for the supported /containers/emails filters."""
+    clauses, params = ["container_id = ?"], [container_id]
+    if filters.get("status"):
+        # "failure" also matches "failure: <reason>"
+        clauses.append("(status = ? OR status LIKE ? ESCAPE '\\')")
+        params += [filters["status"], _escape_like(filters["status"]) + ":%"]
+    if filters.get("recipient"):
+        clauses.append("recipient = ?")
+        params.append(filters["recipient"])
+    if filters.get("source"):
+        # "sender" for campaign records, "maildir" for harvested arrivals
+        clauses.append("source = ?")
+        params.append(filters["source"])
+    if filters.get("subject"):
+        clauses.append("subject LIKE ? ESCAPE '\\'")
+        params.append(f"%{_escape_like(filters['subject'])}%")
+    if filters.get("since") is not None:
+        clauses.append("timestamp >= ?")
+        params.append(filters["since"])
+    if filters.get("until") is not None:
+        clauses.append("timestamp < ?")
+        params.append(filters["until"])
+    return clauses, params
+
+
+def _select_email_logs(clauses, params, include_body, limit=None):
+    columns = EMAIL_LOG_COLUMNS + (", body_hash, template_vars" if include_body else "")
+    sql = (f"SELECT {columns} FROM email_logs WHERE {' AND '.join(clauses)} "
+           # rowid ASC matches the (container_id, timestamp DESC) index order: no sort step
+           "ORDER BY timestamp DESC, rowid ASC")
+    if limit is not None:
+        sql += f" LIMIT {int(limit)}"
+    return get_connection().execute(sql, params)
+
+
+def encode_cursor(timestamp, rowid):
+    return base64.urlsafe_b64encode(json.dumps([timestamp, rowid]).encode()).decode()
+
+
+def decode_cursor(cursor):
+    timestamp, rowid = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    return timestamp, int(rowid)
+
+
+def query_email_logs(container_id, filters=None, cursor=None, limit=100, include_body=False):
+    """One newest-first page of a container's logs using keyset pagination.
+
+    Returns (items, next_cursor); next_cursor is None on the last page. Legacy
+    rows without a timestamp sort after every timestamped row.
+    """
+    clauses, params = _email_log_where(container_id, filters or {})
+    want = limit + 1
+    if cursor is None:
+        rows = _select_email_logs(clauses, params, include_body, want).fetchall()
+    else:
+        timestamp, rowid = decode_cursor(cursor)
+        if timestamp is None:
+            rows = _select_email_logs(clauses + ["timestamp IS NULL AND rowid > ?"],
+                                      params + [rowid], include_body, want).fetchall()
+        else:
+            rows = _select_email_logs(clauses + ["timestamp <= ? AND (timestamp < ? OR rowid > ?)"],
+                                      params + [timestamp, timestamp, rowid], include_body, want).fetchall()
+            if len(rows) < want:
+                rows += _select_email_logs(clauses + ["timestamp IS NULL"], params,
+                                           include_body, want - len(rows)).fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][4], rows[-1][0])
+    return [_email_log_row(r, include_body) for r in rows], next_cursor
+
+
+def iter_email_logs(container_id, filters=None, include_body=False, batch_size=500):
+    """Stream every matching log newest first without materialising the result set."""
+    clauses, params = _email_log_where(container_id, filters or {})
+    cur = _select_email_logs(clauses, params, include_body)
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if not rows:
+            break
+        for r in rows:
+            yield _email_log_row(r, include_body)
+
+
+def get_email_body(container_id, email_id):
+    row = get_connection().execute(
+        'SELECT body_hash, template_vars FROM email_logs WHERE container_id = ? AND rowid = ?',
+        (container_id, email_id)
+    ).fetchone()
+    return _load_body(*row) if row else None
+
+
+def count_email_logs(container_id):
+    """Messages the relay accepted for a container.
+
+    Only successful sender records count: a retried message also leaves deferral rows,
+    and its Maildir arrival is the same message again.
+    """
+    return get_connection().execute(
+        "SELECT COUNT(*) FROM email_logs WHERE container_id = ? AND source = 'sender' AND status = 'success'",
+        (container_id,)
+    ).fetchone()[0]
+
+
+def count_email_logs_by_container():
+    """{container_id: accepted message count} for every container in one grouped index scan."""
+    return dict(get_connection().execute(
+        "SELECT container_id, COUNT(*) FROM email_logs WHERE source = 'sender' AND status = 'success' "
+        "GROUP BY container_id"
+    ).fetchall())
+
+
+@DB_WRITE_SECONDS.timed(op="delete_email_logs")
+def delete_email_logs(container_id):
+    """Drop a container's email logs and its Maildir sync cursor, then unreferenced bodies."""
+    with transaction() as conn:
+        conn.execute('DELETE FROM email_logs WHERE container_id = ?', (container_id,))
+        conn.execute('DELETE FROM maildir_cursor WHERE container_id = ?', (container_id,))
+        conn.execute(
+            'DELETE FROM email_bodies WHERE NOT EXISTS (SELECT 1 FROM email_logs WHERE body_hash = email_bodies.hash)'
+        )
+
+
+# --- postfix_log -----------------------------------------------------------
+
+POSTFIX_LOG_COLUMNS = "rowid, timestamp, queue_id, recipient, status, delay, dsn, relay, detail"
+
+
+@DB_WRITE_SECONDS.timed(op="save_postfix_log")
+def save_postfix_log(container_id, records):
+    with transaction() as conn:
+        conn.executemany('''
+            INSERT OR IGNORE INTO postfix_log
+            (container_id, timestamp, queue_id, recipient, status, delay, dsn, relay, detail)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [
+            (container_id, r["timestamp"], r["queue_id"], r.get("recipient"), r.get("status"),
+             r.get("delay"), r.get("dsn"), r.get("relay"), r.get("detail"))
+            for r in records
+        ])
+
+
+def latest_postfix_log_timestamp(container_id):
+    return get_connection().execute(
+        'SELECT MAX(timestamp) FROM postfix_log WHERE container_id = ?', (container_id,)
+    ).fetchone()[0]
+
+
+def _postfix_log_row(r):
+    return {
+        "id": r[0],
+        "timestamp": r[1],
+        "queue_id": r[2],
+        "recipient": r[3],
+        "status": r[4],
+        "delay": r[5],
+        "dsn": r[6],
+        "relay": r[7],
+        "detail": r[8],
+    }
+
+
+def query_postfix_log(container_id, filters=None, cursor=None, limit=100):
+    """One newest-first page of delivery records; returns (items, next_cursor).
+
+    Filters: status, recipient, queue_id, since/until (epoch seconds). Each
+    equality filter has its own (container_id, column, timestamp) index.
+    """
+    filters = filters or {}
+    clauses, params = ["container_id = ?"], [container_id]
+    for column in ("status", "recipient", "queue_id"):
+        if filters.get(column):
+            clauses.append(f"{column} = ?")
+            params.append(filters[column].lower() if column == "recipient" else filters[column])
+    if filters.get("since") is not None:
+        clauses.append("timestamp >= ?")
+        params.append(filters["since"])
+    if filters.get("until") is not None:
+        clauses.append("timestamp < ?")
+        params.append(filters["until"])
+    if cursor is not None:
+        timestamp, rowid = decode_cursor(cursor)
+        clauses.append("timestamp <= ? AND (timestamp < ? OR rowid > ?)")
+        params += [timestamp, timestamp, rowid]
+    rows = get_connection().execute(
+        f"SELECT {POSTFIX_LOG_COLUMNS} FROM postfix_log WHERE {' AND '.join(clauses)} "
+        f"ORDER BY timestamp DESC, rowid ASC LIMIT {int(limit) + 1}",
+        params
+    ).fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][1], rows[-1][0])
+    return [_postfix_log_row(r) for r in rows], next_cursor
+
+
+@DB_WRITE_SECONDS.timed(op="delete_postfix_log")
+def delete_postfix_log(container_id):
+    with transaction() as conn:
+        conn.execute('DELETE FROM postfix_log WHERE container_id = ?', (container_id,))
+
+
+# --- delivery reconciliation -----------------------------------------------
+
+# Sender records without an outcome yet; after sent, bounced or expired Postfix
+# is done with the recipient
+IN_FLIGHT = ("container_id = ? AND source = 'sender' AND queue_id IS NOT NULL "
+             "AND (final_status IS NULL OR final_status NOT IN ('sent', 'bounced', 'expired'))")
+
+
+@DB_WRITE_SECONDS.timed(op="reconcile_deliveries")
+def reconcile_deliveries(container_id, maildir_keys=()):
+    """Resolve the final status and end-to-end latency of a container's sent messages.
+
+    Each in-flight sender record takes the newest Postfix log status for its
+    (queue id, recipient) from the idx_postfix_log_queue index, plus a delivery
+    time and latency when that status is ``sent``. Records Postfix has no final
+    status for count as ``sent`` once a Maildir arrival with that queue id and
+    envelope recipient has been harvested (under ``container_id`` or any of
+    ``maildir_keys``, e.g. the container's name). Records with a final status
+    are skipped on later runs, so repeated reconciliation only touches messages
+    still in flight.
+
+    Returns how many records were still in flight and how many of those only
+    a Maildir arrival resolved.
+    """
+    keys = [container_id, *maildir_keys]
+    with transaction() as conn:
+        checked = conn.execute(f'''
+            UPDATE email_logs
+            SET (final_status, delivered_at, delivery_latency) = (
+                SELECT p.status, iif(p.status = 'sent', p.timestamp, NULL),
+                       iif(p.status = 'sent', p.timestamp - email_logs.timestamp, NULL)
+                FROM postfix_log AS p
+                WHERE p.container_id = email_logs.container_id
+                  AND p.queue_id = email_logs.queue_id
+                  AND p.recipient = lower(email_logs.recipient)
+                ORDER BY p.timestamp DESC LIMIT 1
+            )
+            WHERE {IN_FLIGHT}
+        ''', (container_id,)).rowcount
+        conn.execute(f'''
+            UPDATE email_logs
+            SET (delivered_at, delivery_latency) = (
+                SELECT MIN(m.timestamp), MIN(m.timestamp) - email_logs.timestamp FROM email_logs AS m
+                WHERE m.queue_id = email_logs.queue_id
+                  AND m.delivered_to = lower(email_logs.recipient)
+                  AND m.container_id IN ({",".join("?" * len(keys))})
+            )
+            WHERE {IN_FLIGHT}
+        ''', (*keys, container_id))
+        from_maildir = conn.execute(f'''
+            UPDATE email_logs SET final_status = 'sent'
+            WHERE {IN_FLIGHT} AND delivered_at IS NOT NULL
+        ''', (container_id,)).rowcount
+    return {"checked": checked, "from_maildir": from_maildir}
+
+
+def delivery_summary(container_id, percentiles=(50, 90, 99)):
+    """Counts per final status and latency percentiles over a container's sent messages."""
+    conn = get_connection()
+    by_status = dict(conn.execute('''
+        SELECT coalesce(final_status, 'unknown'), COUNT(*) FROM email_logs
+        WHERE container_id = ? AND source = 'sender' AND queue_id IS NOT NULL
+        GROUP BY final_status
+    ''', (container_id,)).fetchall())
+    latencies = [r[0] for r in conn.execute('''
+        SELECT delivery_latency FROM email_logs
+        WHERE container_id = ? AND source = 'sender' AND queue_id IS NOT NULL
+          AND final_status = 'sent' AND delivery_latency IS NOT NULL
+        ORDER BY delivery_latency
+    ''', (container_id,))]
+    latency = {}
+    if latencies:
+        latency = {f"p{p}": latencies[min(len(latencies) - 1, len(latencies) * p // 100)] for p in percentiles}
+        latency["max"] = latencies[-1]
+    return {"by_status": by_status, "latency_seconds": latency}
+
+
+# --- maildir_cursor --------------------------------------------------------
+
+def get_maildir_cursor(container_id, users):
+    """Return the (user, filename) pairs already ingested for these users of a container."""
+    placeholders = ",".join("?" * len(users))
+    rows = get_connection().execute(
+        f'SELECT user, filename FROM maildir_cursor WHERE container_id = ? AND user IN ({placeholders})',
+        [container_id, *users]
+    ).fetchall()
+    return set(rows)
+
+
+@DB_WRITE_SECONDS.timed(op="update_maildir_cursor")
+def update_maildir_cursor(container_id, added, removed):
+    with transaction() as conn:
+        conn.executemany('INSERT OR IGNORE INTO maildir_cursor (container_id, user, filename) VALUES (?, ?, ?)',
+                         [(container_id, u, f) for u, f in added])
+        conn.executemany('DELETE FROM maildir_cursor WHERE container_id = ? AND user = ? AND filename = ?',
+                         [(container_id, u, f) for u, f in removed])
+
+
+# --- email_templates -------------------------------------------------------
+
+def list_templates(include_design=True):
+    """Rows of (id, name, html, updated_at), plus design_json when ``include_design``."""
+    columns = "id, name, html, updated_at" + (", design_json" if include_design else "")
+    return get_connection().execute(f"SELECT {columns} FROM email_templates ORDER BY id").fetchall()
+
+
+def templates_version():
+    """A string that changes whenever a template is added or saved again."""
+    count, updated_at = get_connection().execute(
+        "SELECT COUNT(*), MAX(updated_at) FROM email_templates"
+    ).fetchone()
+    return f"{count}-{updated_at or 0:.6f}"
+
+
+@DB_WRITE_SECONDS.timed(op="save_template")
+def save_template(name, html, design_json, created_at):
+    # An upsert keeps the template's id stable across edits
+    with transaction() as conn:
+        conn.execute(
+            "INSERT INTO email_templates (name, html, design_json, created_at, updated_at) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET "
+            "html = excluded.html, design_json = excluded.design_json, updated_at = excluded.updated_at",
+            (name, html, design_json, created_at, created_at)
+        )
@@ -0,0 +1,104 @@
+import threading
+import time
+
+import docker
+
+CONTAINER_CACHE_TTL = 30  # seconds; safety net in case an event is missed
+
+
+class LazyDockerClient:
+    """Proxy that calls ``docker.from_env()`` on first use, so importing the app needs no daemon."""
+
+    def __init__(self, factory=docker.from_env):
+        self._factory = factory
+        self._client = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._factory()
+        return getattr(self._client, name)
+
+
+def container_state(container):
+    return {
+        "id": container.id,
+        "name": container.name,
+        "status": container.status,
+        "started_at": container.attrs['State']['StartedAt'],
+    }
+
+
+class ContainerStateCache:
+    """In-memory snapshot of Docker container state kept fresh by the events stream.
+
+    The first call inspects every container; after that only containers named
+    in a Docker event are re-inspected, and the whole snapshot is reloaded at
+    most every ``ttl`` seconds.
+    """
+
+    def __init__(self, client, ttl=CONTAINER_CACHE_TTL):
+        self.client = client
+        self.ttl = ttl
+        self._states = {}
+        self._dirty = set()
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        self._watcher = None
+
+    def containers(self):
+        """Return the state dicts of all containers, refreshing only what changed."""
+        self._ensure_watcher()
+        with self._lock:
+            if self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl:
+                self._reload()
+            elif self._dirty:
+                self._refresh_dirty()
+            return list(self._states.values())
+
+    def get(self, container_id):
+        """State of one container by full id, name or id prefix; None if unknown."""
+        for state in self.containers():
+            if container_id in (state["id"], state["name"]) or state["id"].startswith(container_id):
+                return state
+        return None
+
+    def invalidate(self, container_id=None):
+        """Mark one container (or everything, with no id) as stale."""
+        with self._lock:
+            if container_id is None:
+                self._loaded_at = None
+            else:
+                self._dirty.add(container_id)
+
+    def _reload(self):
+        self._states = {c.id: container_state(c) for c in self.client.containers.list(all=True)}
+        self._dirty.clear()
+        self._loaded_at = time.monotonic()
+
+    def _refresh_dirty(self):
+        for container_id in self._dirty:
+            try:
+                container = self.client.containers.get(container_id)
+                self._states[container.id] = container_state(container)
+            except docker.errors.NotFound:
+                self._states.pop(container_id, None)
+        self._dirty.clear()
+
+    def _ensure_watcher(self):
+        if self._watcher is None:
+            self._watcher = threading.Thread(target=self._watch_events, daemon=True)
+            self._watcher.start()
+
+    def _watch_events(self):
+        while True:
+            try:
+                for event in self.client.events(decode=True, filters={"type": "container"}):
+                    self.invalidate(event.get("id"))
+            except Exception as e:
+                print(f"⚠️ Docker events stream interrupted: {e}")
+            # Events may have been missed while disconnected
+            self.invalidate()
+            time.sleep(5)
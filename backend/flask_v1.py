@@ -1,142 +1,98 @@
-from flask import Flask, jsonify, request
+from flask import Flask, jsonify, request, Response, stream_with_context, g
 import docker
 import time
 import os
+import itertools
 import json
-import sqlite3
-import email
 import flask_cors
-import requests
+from docker_state import ContainerStateCache, LazyDockerClient
+from stats_collector import StatsCollector
+from jobs import JobManager, iter_job_events
+from fleet import FleetManager
+from generation import GenerationService
+from mail_parser import parse_mail_batch
+from metrics import METRICS_ENABLED, REGISTRY
+from maildir import list_maildir_new, iter_maildir_files, move_to_cur, maildir_timestamp
+from postfix_logs import PostfixLogIngester
+from db import (
+    init_db, release_connection, save_email_logs_to_db, count_email_logs, count_email_logs_by_container,
+    delete_email_logs,
+    query_email_logs, iter_email_logs, get_email_body,
+    get_maildir_cursor, update_maildir_cursor, list_templates, templates_version, save_template,
+    save_postfix_log, latest_postfix_log_timestamp, query_postfix_log, delete_postfix_log,
+    reconcile_deliveries, delivery_summary,
+)
 
 app = Flask(__name__)
 flask_cors.CORS(app)
-client = docker.from_env()
+# Set up by create_app(). Importing this module must stay free of side effects:
+# multiprocessing re-imports the main script in its forkserver and workers.
+client = container_cache = stats_collector = job_manager = log_ingester = None
+fleet_manager = generation_service = None
 
 BASE_EMAIL = "base@localhost"
-USER_COUNT = 50
-
-DB_PATH = 'email_logs.db'
-
-def init_db():
-    with sqlite3.connect(DB_PATH) as conn:
-        c = conn.cursor()
-        # Existing email_logs table
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS email_logs (
-                container_id TEXT,
-                recipient TEXT,
-                subject TEXT,
-                status TEXT,
-                timestamp REAL,
-                body_snippet TEXT,
-                body_html TEXT,
-                PRIMARY KEY (container_id, recipient, subject, timestamp)
-            )
-        ''')
-
-        # Ensure column exists (for backwards compatibility)
-        try:
-            c.execute("ALTER TABLE email_logs ADD COLUMN body_html TEXT")
-        except sqlite3.OperationalError:
-            pass  # already exists
-
-        # Email templates table
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS email_templates (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT UNIQUE,
-                design_json TEXT,
-                html TEXT,
-                created_at REAL
-            )
-        ''')
-        conn.commit()
-
-
-init_db()
-def save_email_logs_to_db(container_id, logs):
-    with sqlite3.connect(DB_PATH) as conn:
-        c = conn.cursor()
-        for record in logs:
-            c.execute('''
-                INSERT OR REPLACE INTO email_logs
-                (container_id, recipient, subject, status, timestamp, body_snippet, body_html)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                container_id,
-                record.get('to'),
-                record.get('subject'),
-                record.get('status'),
-                record.get('timestamp'),
-                record.get('body_snippet') or '',
-                record.get('body_html') or ''
-            ))
-        conn.commit()
-
-
-def get_email_logs_from_db(container_id):
-    with sqlite3.connect(DB_PATH) as conn:
-        c = conn.cursor()
-        c.execute('SELECT recipient, subject, status, timestamp, body_snippet FROM email_logs WHERE container_id = ? ORDER BY timestamp DESC', (container_id,))
-        rows = c.fetchall()
-        return [
-            {
-                "to": r[0],
-                "subject": r[1],
-                "status": r[2],
-                "timestamp": r[3],
-                "body_snippet": r[4]
-            }
-            for r in rows
-        ]
-
-def parse_mail_content(raw_content):
-    msg = email.message_from_bytes(raw_content)
-    mail_info = {
-        'from': msg.get('From'),
-        'to': msg.get('To'),
-        'subject': msg.get('Subject'),
-        'date': msg.get('Date'),
-        'body_snippet': '',
-        'body_html': '',
-        'status': 'success'
-    }
+USER_COUNT = int(os.environ.get("USER_COUNT", 50))
+MAILDIR_SYNC_BATCH = 500  # messages parsed and stored at a time while the tar streams
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    "http_request_seconds", "Time to produce a response (streamed bodies excluded)", ("route", "method", "status")
+)
 
-    if msg.is_multipart():
-        for part in msg.walk():
-            ctype = part.get_content_type()
-            if ctype == 'text/html':
-                mail_info['body_html'] = part.get_payload(decode=True).decode(errors='ignore')
-            elif ctype == 'text/plain' and not mail_info['body_snippet']:
-                mail_info['body_snippet'] = part.get_payload(decode=True)[:100].decode(errors='ignore')
-    else:
-        ctype = msg.get_content_type()
-        payload = msg.get_payload(decode=True)
-        if ctype == 'text/html':
-            mail_info['body_html'] = payload.decode(errors='ignore')
-            mail_info['body_snippet'] = mail_info['body_html'][:100]
-        else:
-            mail_info['body_snippet'] = payload[:100].decode(errors='ignore')
 
-    return mail_info
+@app.before_request
+def _start_request_timer():
+    if METRICS_ENABLED:
+        g.request_started = time.perf_counter()
+
+
+@app.after_request
+def _observe_request(response):
+    started = g.get("request_started")
+    if started is not None:
+        # The URL rule, not the path, so ids in URLs don't explode the label set
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        REQUEST_SECONDS.observe(time.perf_counter() - started,
+                                route=route, method=request.method, status=response.status_code)
+    return response
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    if not METRICS_ENABLED:
+        return jsonify({"error": "Metrics are disabled (METRICS_ENABLED=0)"}), 404
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
 
 
 
 @app.route("/mails", methods=["GET"])
 def get_mails():
-    with sqlite3.connect(DB_PATH) as conn:
-        c = conn.cursor()
-        c.execute("SELECT id, name, html, design_json FROM email_templates")
-        rows = c.fetchall()
-        return jsonify([
-            {
-                "id": str(r[0]),
-                "name": r[1],
-                "html": r[2],
-                "design": json.loads(r[3]) if r[3] else {}
-            }
+    """List templates; ?lite=1 omits the editor design, which senders never use.
+
+    Responses carry an ETag for the current template version, and a matching
+    If-None-Match is answered with 304 without reading the templates.
+    """
+    lite = request.args.get('lite', '').lower() in ('1', 'true')
+    etag = f"{templates_version()}-{'lite' if lite else 'full'}"
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    rows = list_templates(include_design=not lite)
+    if lite:
+        response = jsonify([
+            {"id": str(r[0]), "name": r[1], "html": r[2], "updated_at": r[3]}
             for r in rows
         ])
+    else:
+        # design_json is stored as JSON text already: splice it in rather than parse and re-encode it
+        response = Response("[" + ",".join(
+            json.dumps({"id": str(r[0]), "name": r[1], "html": r[2], "updated_at": r[3]})[:-1]
+            + ', "design": ' + (r[4] or "{}") + "}"
+            for r in rows
+        ) + "]", mimetype="application/json")
+    response.set_etag(etag)
+    return response
 
 
 
@@ -146,13 +102,7 @@ def save_mail():
     print("Received data:", data)  # Debug line
 
     try:
-        with sqlite3.connect(DB_PATH) as conn:
-            c = conn.cursor()
-            c.execute(
-                "INSERT OR REPLACE INTO email_templates (name, html, design_json, created_at) VALUES (?, ?, ?, ?)",
-                (data.get("name"), data.get("html"), json.dumps(data.get("design")), time.time())
-            )
-            conn.commit()
+        save_template(data.get("name"), data.get("html"), json.dumps(data.get("design")), time.time())
         return jsonify({"status": "saved"}), 201
     except Exception as e:
         print("Error saving mail:", e)
@@ -172,36 +122,71 @@ def fetch_mail_data(container_name):
     else:
         user_indices = range(1, USER_COUNT + 1)
 
+    # ?move=1 files ingested messages into cur/; ?new_only=1 returns just this sync's messages,
+    # otherwise the newest ?limit= (default 100, max 1000) stored arrivals come back.
+    # Messages are synced in batches of MAILDIR_SYNC_BATCH, but new_only keeps all of them for the reply
+    move_processed = request.args.get('move', '').lower() in ('1', 'true')
+    new_only = request.args.get('new_only', '').lower() in ('1', 'true')
+    try:
+        limit = min(max(int(request.args.get('limit', 100)), 1), 1000)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query parameter: {e}"}), 400
+
     mail_data = []
-    for i in user_indices:
-        maildir_path = f"/home/user{i}/Maildir/new"
-        try:
-            cmd_ls = f"ls {maildir_path}"
-            exit_code, output = container.exec_run(cmd_ls)
-            if exit_code != 0:
-                continue
-            mail_files = output.decode().strip().split('\n')
-            for mail_file in mail_files:
-                cmd_cat = f"cat {maildir_path}/{mail_file}"
-                exit_code, mail_content = container.exec_run(cmd_cat)
-                if exit_code != 0:
-                    continue
-                mail_info = parse_mail_content(mail_content)
-                mail_info['user'] = f"user{i}"
-                mail_data.append(mail_info)
-        except Exception:
-            continue
+    users = [f"user{i}" for i in user_indices]
+    try:
+        # Maildir filenames are unique, so the set already ingested is the sync cursor
+        listing = list_maildir_new(container, users)
+        seen = get_maildir_cursor(container_name, users)
+        new_files = sorted(listing - seen)
+        # Files gone from new/ (moved or deleted) can never come back under the same name
+        update_maildir_cursor(container_name, added=(), removed=seen - listing)
+        # Only one batch of messages is held at a time; each is stored and
+        # checkpointed before the next is read from the stream
+        fetched_files = iter_maildir_files(container, new_files)
+        while True:
+            fetched = list(itertools.islice(fetched_files, MAILDIR_SYNC_BATCH))
+            if not fetched:
+                break
+            parsed = parse_mail_batch([mail_content for _, _, mail_content in fetched])
+            for (user, filename, _), mail_info in zip(fetched, parsed):
+                mail_info['user'] = user
+                # Batched sends all carry the same To: header, so rows are keyed by
+                # the envelope recipient and the (unique) Maildir file instead
+                mail_info['delivered_to'] = mail_info.get('delivered_to') or f"{user}@localhost"
+                mail_info['to'] = mail_info['delivered_to']
+                mail_info['maildir_file'] = f"{user}/{filename}"
+                mail_info['timestamp'] = maildir_timestamp(filename)
+
+            save_email_logs_to_db(container_name, parsed, source="maildir")
+            # Only files tar actually returned count as ingested, the rest are retried next sync
+            ingested = [(user, filename) for user, filename, _ in fetched]
+            update_maildir_cursor(container_name, added=ingested, removed=())
+            if move_processed:
+                move_to_cur(container, ingested)
+            if new_only:
+                mail_data.extend(parsed)
+    except Exception as e:
+        print(f"❌ Failed to sync Maildirs from {container_name}: {e}")
+
+    if new_only:
+        return jsonify(mail_data)
+    # The newest harvested arrivals, bodies included; older ones page through /containers/emails
+    items, _ = query_email_logs(container_name, {"source": "maildir"}, limit=limit, include_body=True)
+    return jsonify(items)
 
-    # Save these logs to DB asynchronously if you want, else do now for demo
-    # For simplicity, let's save here on fetch (optional, can be moved per your app logic)
-    save_email_logs_to_db(container_name, mail_data)
 
-    return jsonify(mail_data)
+def create_postfix_container():
+    container = client.containers.run("mypostfix", detach=True, ports={'25/tcp': None})
+    container_cache.invalidate(container.id)
+    log_ingester.track(container.id)
+    return container
+
 
 
 @app.route('/containers/create', methods=['POST'])
 def create_container():
-    container = client.containers.run("mypostfix", detach=True, ports={'25/tcp': None})
+    container = create_postfix_container()
     return jsonify({"id": container.id, "name": container.name})
 
 
@@ -209,152 +194,331 @@ def create_container():
 def delete_container(container_id):
     container = client.containers.get(container_id)
     container.remove(force=True)
+    container_cache.invalidate(container.id)
+    stats_collector.forget(container.id)
+    log_ingester.forget(container.id)
     # Delete all email logs associated with this container
-    with sqlite3.connect(DB_PATH) as conn:
-        c = conn.cursor()
-        c.execute('DELETE FROM email_logs WHERE container_id = ?', (container_id,))
-        conn.commit()
+    delete_email_logs(container_id)
+    delete_postfix_log(container.id)
     return jsonify({"removed": container_id})
 
 
 @app.route('/containers', methods=['GET'])
 def list_containers():
     containers = []
-    for c in client.containers.list(all=True):
-        # For emails sent count, count entries in sqlite for container
-        with sqlite3.connect(DB_PATH) as conn:
-            c_db = conn.cursor()
-            c_db.execute('SELECT COUNT(*) FROM email_logs WHERE container_id = ?', (c.id,))
-            count = c_db.fetchone()[0]
-
+    # For emails sent count, count entries in sqlite per container in one query
+    counts = count_email_logs_by_container()
+    for c in container_cache.containers():
+        if c["status"] == "running":
+            # Warm the stats buffer before the dashboard asks for it
+            stats_collector.track(c["id"])
+            log_ingester.track(c["id"])
         containers.append({
-            "id": c.id,
-            "name": c.name,
-            "status": c.status,
+            "id": c["id"],
+            "name": c["name"],
+            "status": c["status"],
             "base_email": BASE_EMAIL,
             "user_count": USER_COUNT,
-            "uptime_seconds": get_uptime(c) if c.status == "running" else 0,
-            "emails_sent": count
+            "uptime_seconds": uptime_since(c["started_at"]) if c["status"] == "running" else 0,
+            "emails_sent": counts.get(c["id"], 0)
         })
     return jsonify(containers)
 
 
 @app.route('/containers/stats/<container_id>', methods=['GET'])
 def container_stats(container_id):
-    container = client.containers.get(container_id)
-    try:
-        usage = container.stats(stream=False)
-        cpu_delta = usage['cpu_stats']['cpu_usage']['total_usage'] - usage['precpu_stats']['cpu_usage']['total_usage']
-        system_delta = usage['cpu_stats']['system_cpu_usage'] - usage['precpu_stats']['system_cpu_usage']
-        cpu_percent = (cpu_delta / system_delta) * len(usage['cpu_stats']['cpu_usage']['percpu_usage']) * 100.0 if system_delta > 0 else 0.0
-        mem_usage = usage['memory_stats']['usage']
-        mem_limit = usage['memory_stats']['limit']
-        mem_percent = mem_usage / mem_limit * 100.0 if mem_limit > 0 else 0.0
-    except Exception:
-        cpu_percent = mem_usage = mem_limit = mem_percent = 0
-
-    emails_sent = 0
-    with sqlite3.connect(DB_PATH) as conn:
-        c_db = conn.cursor()
-        c_db.execute('SELECT COUNT(*) FROM email_logs WHERE container_id = ?', (container_id,))
-        emails_sent = c_db.fetchone()[0]
+    """Latest resource sample from the background collector; ?history=<seconds> adds a chart window."""
+    state = container_cache.get(container_id)
+    if state is None:
+        return jsonify({'error': 'Container not found'}), 404
 
-    return jsonify({
+    sample = stats_collector.latest(state["id"]) if state["status"] == "running" else None
+    sample = sample or {}
+
+    emails_sent = count_email_logs(state["id"])
+
+    response = {
         "container_id": container_id,
         "emails_sent": emails_sent,
-        "uptime_seconds": get_uptime(container),
-        "cpu_percent": cpu_percent,
-        "memory_usage": mem_usage,
-        "memory_limit": mem_limit,
-        "memory_percent": mem_percent
-    })
+        "uptime_seconds": uptime_since(state["started_at"]) if state["status"] == "running" else 0,
+        "cpu_percent": sample.get("cpu_percent", 0),
+        "memory_usage": sample.get("memory_usage", 0),
+        "memory_limit": sample.get("memory_limit", 0),
+        "memory_percent": sample.get("memory_percent", 0),
+        "network_rx_bytes": sample.get("network_rx_bytes", 0),
+        "network_tx_bytes": sample.get("network_tx_bytes", 0),
+        "block_read_bytes": sample.get("block_read_bytes", 0),
+        "block_write_bytes": sample.get("block_write_bytes", 0),
+        "sampled_at": sample.get("timestamp")
+    }
+    if request.args.get('history'):
+        try:
+            window = float(request.args['history'])
+        except ValueError as e:
+            return jsonify({"error": f"Invalid query parameter: {e}"}), 400
+        response["history"] = stats_collector.history(state["id"], window)
+    return jsonify(response)
+
+
+def _email_log_filters(args):
+    filters = {
+        "status": args.get('status'),
+        "recipient": args.get('recipient'),
+        "subject": args.get('subject'),
+        "source": args.get('source'),
+    }
+    for key in ('since', 'until'):
+        if args.get(key):
+            filters[key] = float(args[key])
+    return filters
 
 
 @app.route('/containers/emails/<container_id>', methods=['GET'])
 def container_email_logs(container_id):
+    """Newest-first email logs for a container.
+
+    Query params: limit (default 100, max 1000), cursor (from next_cursor),
+    status, recipient, subject (substring), source (sender or maildir),
+    since/until (epoch seconds), include_body=1 to inline body_html,
+    format=stream for a full chunked export.
+    """
     try:
-        with sqlite3.connect(DB_PATH) as conn:
-            c = conn.cursor()
-            c.execute('SELECT recipient, subject, status, timestamp, body_snippet, body_html FROM email_logs WHERE container_id = ? ORDER BY timestamp DESC', (container_id,))
-            rows = c.fetchall()
-        logs = [
-            {
-                "to": r[0],
-                "subject": r[1],
-                "status": r[2],
-                "timestamp": r[3],
-                "body_snippet": r[4],
-                "body_html": r[5]
-            }
-            for r in rows
-        ]
-        return jsonify(logs)
+        filters = _email_log_filters(request.args)
+        include_body = request.args.get('include_body', '').lower() in ('1', 'true')
+
+        if request.args.get('format') == 'stream':
+            def generate():
+                yield '['
+                for n, log in enumerate(iter_email_logs(container_id, filters, include_body)):
+                    yield (',' if n else '') + json.dumps(log)
+                yield ']'
+            return Response(stream_with_context(generate()), mimetype='application/json')
+
+        limit = min(max(int(request.args.get('limit', 100)), 1), 1000)
+        items, next_cursor = query_email_logs(
+            container_id, filters, request.args.get('cursor'), limit, include_body
+        )
+        return jsonify({"items": items, "next_cursor": next_cursor})
+    except (ValueError, TypeError) as e:
+        return jsonify({"error": f"Invalid query parameter: {e}"}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+@app.route('/containers/emails/<container_id>/<int:email_id>/body', methods=['GET'])
+def container_email_body(container_id, email_id):
+    body_html = get_email_body(container_id, email_id)
+    if body_html is None:
+        return jsonify({"error": "Email not found"}), 404
+    return jsonify({"id": email_id, "body_html": body_html})
+
+
 
 @app.route('/containers/send-emails/<container_id>', methods=['POST'])
 def send_emails(container_id):
-    container = client.containers.get(container_id)
-    if container.status != "running":
-        container.start()
-    exec_result = container.exec_run("python3 /send_emails.py")
-    output = exec_result.output.decode(errors="ignore")
-    # Possibly parse output or logs here and update DB (omitted for simplicity)
-    return jsonify({"container_id": container_id, "output": output})
+    """Queue a campaign run and return its job id straight away.
+
+    An optional JSON body {"user_count": N} sends to user1..userN instead of USER_COUNT;
+    {"max_concurrent": N} lets the job start while fewer than N others run on
+    this container (default JOB_CONCURRENCY_PER_CONTAINER).
+    """
+    try:
+        container = client.containers.get(container_id)
+    except docker.errors.NotFound:
+        return jsonify({'error': 'Container not found'}), 404
+    data = request.get_json(silent=True) or {}
+    environment = None
+    if data.get("user_count") is not None:
+        try:
+            environment = {"USER_COUNT": str(int(data["user_count"]))}
+        except (TypeError, ValueError):
+            return jsonify({'error': 'user_count must be an integer'}), 400
+    max_concurrent = None
+    if data.get("max_concurrent") is not None:
+        try:
+            max_concurrent = int(data["max_concurrent"])
+        except (TypeError, ValueError):
+            return jsonify({'error': 'max_concurrent must be an integer'}), 400
+    job = job_manager.submit(container.id, environment=environment, max_concurrent=max_concurrent)
+    return jsonify({
+        "container_id": container_id,
+        "job_id": job.id,
+        "status_url": f"/containers/send-emails/jobs/{job.id}",
+        "events_url": f"/containers/send-emails/jobs/{job.id}/events"
+    }), 202
+
+
+@app.route('/containers/send-emails/jobs/<job_id>', methods=['GET'])
+def send_emails_job(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.snapshot(include_output=True))
+
+
+@app.route('/containers/send-emails/jobs/<job_id>/events', methods=['GET'])
+def send_emails_job_events(job_id):
+    """Server-Sent Events: one 'progress' event per change, then a final 'done' event."""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+
+    def generate():
+        for snapshot in iter_job_events(job):
+            if snapshot is None:
+                yield ": keepalive\n\n"
+                continue
+            event = "done" if snapshot["status"] in ("finished", "failed") else "progress"
+            yield f"event: {event}\ndata: {json.dumps(snapshot)}\n\n"
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/fleet/campaigns', methods=['POST'])
+def create_fleet_campaign():
+    """Shard a recipient list over existing and/or new mypostfix containers.
+
+    JSON body: recipients (list) or recipient_count (user1..userN@localhost),
+    container_ids (existing containers), containers (number of new ones to
+    create), environment (extra env for send_emails.py, e.g. SEND_RATE).
+    """
+    data = request.json or {}
+    try:
+        recipients = data.get("recipients")
+        if recipients is None:
+            recipients = [f"user{i}@localhost" for i in range(1, int(data.get("recipient_count", USER_COUNT)) + 1)]
+        container_ids = [client.containers.get(cid).id for cid in data.get("container_ids", [])]
+        campaign = fleet_manager.launch(
+            recipients,
+            container_ids=container_ids,
+            new_containers=int(data.get("containers", 0)),
+            environment=data.get("environment"),
+        )
+    except docker.errors.NotFound as e:
+        return jsonify({"error": str(e)}), 404
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(campaign.snapshot()), 202
+
+
+@app.route('/fleet/campaigns/<campaign_id>', methods=['GET'])
+def get_fleet_campaign(campaign_id):
+    campaign = fleet_manager.get(campaign_id)
+    if campaign is None:
+        return jsonify({'error': 'Campaign not found'}), 404
+    return jsonify(campaign.snapshot())
+
+
+POSTFIX_LOG_QUERY_PARAMS = ('status', 'recipient', 'queue_id', 'since', 'until', 'cursor', 'limit')
 
 
 @app.route('/containers/logs/<container_id>', methods=['GET'])
 def get_logs(container_id):
-    container = client.containers.get(container_id)
-    filter_level = request.args.get('filter', None)
-    raw_logs = container.logs(tail=200).decode(errors="ignore").splitlines()
+    """Container logs, followed in the background rather than re-downloaded per request.
+
+    Without query params (or with filter=error) this returns the recent raw
+    lines as {"logs": "..."}. With any of status (sent/deferred/bounced/...),
+    recipient, queue_id, since/until (epoch seconds), cursor or limit it pages
+    through the parsed Postfix delivery records instead.
+    """
+    state = container_cache.get(container_id)
+    if state is None:
+        return jsonify({'error': 'Container not found'}), 404
 
-    if filter_level == 'error':
+    if any(request.args.get(p) for p in POSTFIX_LOG_QUERY_PARAMS):
+        try:
+            filters = {key: request.args.get(key) for key in ('status', 'recipient', 'queue_id')}
+            for key in ('since', 'until'):
+                if request.args.get(key):
+                    filters[key] = float(request.args[key])
+            limit = min(max(int(request.args.get('limit', 100)), 1), 1000)
+            items, next_cursor = query_postfix_log(state["id"], filters, request.args.get('cursor'), limit)
+        except (ValueError, TypeError) as e:
+            return jsonify({"error": f"Invalid query parameter: {e}"}), 400
+        return jsonify({"items": items, "next_cursor": next_cursor})
+
+    raw_logs = log_ingester.tail(state["id"])
+    if request.args.get('filter') == 'error':
         filtered_logs = [line for line in raw_logs if 'error' in line.lower() or 'reject' in line.lower()]
         return jsonify({"logs": "\n".join(filtered_logs)})
 
     return jsonify({"logs": "\n".join(raw_logs)})
 
 
+@app.route('/containers/deliveries/<container_id>', methods=['POST'])
+def reconcile_container_deliveries(container_id):
+    """Resolve final status and delivery latency for the container's sent messages.
+
+    Sender records are matched by Postfix queue id with the container's parsed
+    Postfix log and with Maildir arrivals harvested by /containers/maildata.
+    Per-message results appear as final_status, delivered_at and
+    delivery_latency in /containers/emails; this returns the run's counts and
+    a summary by final status with latency percentiles.
+    """
+    state = container_cache.get(container_id)
+    if state is None:
+        return jsonify({'error': 'Container not found'}), 404
+    # Records the follower has parsed but not stored yet
+    log_ingester.track(state["id"])
+    log_ingester.flush(state["id"])
+    # Maildir syncs store rows under whichever name or id the client used
+    maildir_keys = {container_id, state["name"]} - {state["id"]}
+    try:
+        reconciled = reconcile_deliveries(state["id"], sorted(maildir_keys))
+        return jsonify({"reconciled": reconciled, "summary": delivery_summary(state["id"])})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
 # Helper to get container uptime in seconds
-def get_uptime(container):
-    started_at = container.attrs['State']['StartedAt']
+def uptime_since(started_at):
     start_time = time.strptime(started_at.split('.')[0], "%Y-%m-%dT%H:%M:%S")
     start_epoch = time.mktime(start_time)
     return int(time.time() - start_epoch)
-SERVER = "https://puspeshd.pythonanywhere.com"
+
 
 @app.route("/generate", methods=["POST"])
 def generate():
-    """Frontend → Local Flask → PythonAnywhere → Colab → back"""
-    data = request.json
+    """Frontend → Local Flask → PythonAnywhere → Colab → back
+
+    Returns a ticket straight away (202); poll GET /generate/<ticket> for the
+    result. Prompts answered recently come back immediately from the cache.
+    """
+    data = request.json or {}
     prompt = data.get("prompt")
     if not prompt:
         return jsonify({"error": "Missing prompt"}), 400
 
-    try:
-        # Send the prompt to the central server
-        requests.post(f"{SERVER}/send_prompt", json={"prompt": prompt})
-        print(f"✅ Sent prompt: {prompt}")
+    ticket = generation_service.submit(prompt)
+    return jsonify(ticket.to_dict()), 200 if ticket.status == "done" else 202
 
-        # Poll for result until it's ready
-        while True:
-            res = requests.get(f"{SERVER}/get_result").json()
-            if res.get("result") != "pending":
-                print("✅ Got response from model")
-                print(res.get('result'))
-                try:
-                    result_final = res.get('result',"").replace(prompt,"")
-                except:
-                    pass
-                return jsonify({"result": result_final})
-            time.sleep(3)
-    except Exception as e:
-        print("❌ Error:", e)
-        return jsonify({"error": str(e)}), 500
 
-if __name__ == '__main__':
+@app.route("/generate/<ticket_id>", methods=["GET"])
+def generate_result(ticket_id):
+    ticket = generation_service.get(ticket_id)
+    if ticket is None:
+        return jsonify({"error": "Unknown ticket"}), 404
+    return jsonify(ticket.to_dict())
+
+
+def create_app():
+    """Migrate the database and build the Docker-backed services; call once per process.
+
+    ``python flask_v1.py`` does this itself; under a WSGI server use ``flask_v1:create_app()``.
+    """
+    global client, container_cache, stats_collector, job_manager, log_ingester, fleet_manager, generation_service
     init_db()
-    app.run(debug=True, host='0.0.0.0')
+    client = LazyDockerClient()
+    container_cache = ContainerStateCache(client)
+    stats_collector = StatsCollector(client)
+    job_manager = JobManager(client, ingest=save_email_logs_to_db)
+    log_ingester = PostfixLogIngester(client, store=save_postfix_log, resume_from=latest_postfix_log_timestamp)
+    fleet_manager = FleetManager(client, job_manager, create_postfix_container)
+    generation_service = GenerationService()
+    app.teardown_appcontext(release_connection)
+    return app
+
+
+if __name__ == '__main__':
+    create_app().run(debug=True, host='0.0.0.0')
@@ -0,0 +1,140 @@
+import io
+import tarfile
+import threading
+import time
+import uuid
+
+FLEET_READY_TIMEOUT = 60  # seconds to wait for Postfix in a fresh container
+SHARD_DIR = "/tmp"
+
+
+def shard_recipients(recipients, weights):
+    """Split recipients into len(weights) contiguous shards sized proportionally to the weights.
+
+    Uses largest-remainder rounding so shard sizes always add up exactly.
+    """
+    total_weight = sum(weights)
+    quotas = [len(recipients) * w / total_weight for w in weights]
+    sizes = [int(q) for q in quotas]
+    by_remainder = sorted(range(len(weights)), key=lambda i: quotas[i] - sizes[i], reverse=True)
+    for i in by_remainder[:len(recipients) - sum(sizes)]:
+        sizes[i] += 1
+    shards, start = [], 0
+    for size in sizes:
+        shards.append(recipients[start:start + size])
+        start += size
+    return shards
+
+
+def _tar_file(name, data):
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w") as tar:
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        tar.addfile(info, io.BytesIO(data))
+    return buf.getvalue()
+
+
+def wait_until_ready(container, timeout=FLEET_READY_TIMEOUT):
+    """Block until Postfix inside the container answers 'postfix status'."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        exit_code, _ = container.exec_run(["postfix", "status"])
+        if exit_code == 0:
+            return
+        time.sleep(1)
+    raise TimeoutError(f"Postfix in {container.name} not ready after {timeout}s")
+
+
+class FleetCampaign:
+    """One recipient list sharded over several containers, one campaign job per shard."""
+
+    def __init__(self, shards):
+        self.id = uuid.uuid4().hex
+        self.created_at = time.time()
+        self.shards = shards  # [{"container_id", "recipients", "job"}]
+
+    def snapshot(self):
+        jobs = [s["job"].snapshot() for s in self.shards]
+        statuses = {j["status"] for j in jobs}
+        if statuses <= {"finished"}:
+            status = "finished"
+        elif statuses <= {"finished", "failed"}:
+            status = "failed"
+        else:
+            status = "running" if "running" in statuses else "queued"
+        return {
+            "campaign_id": self.id,
+            "status": status,
+            "created_at": self.created_at,
+            "recipients": sum(s["recipients"] for s in self.shards),
+            "sent": sum(j["sent"] for j in jobs),
+            "failed": sum(j["failed"] for j in jobs),
+            "deferred": sum(j["deferred"] for j in jobs),
+            "rate_per_sec": sum(j["rate_per_sec"] for j in jobs if j["status"] == "running"),
+            "shards": [dict(job, recipients=s["recipients"]) for s, job in zip(self.shards, jobs)],
+        }
+
+
+class FleetManager:
+    """Fans a campaign out across mypostfix containers.
+
+    Shards are weighted by each container's observed send rate (from its last
+    finished job), so faster containers get more recipients. Every shard runs
+    as a normal campaign job, so its records land in email_logs as they arrive.
+    """
+
+    def __init__(self, client, job_manager, create_container):
+        self.client = client
+        self.job_manager = job_manager
+        self.create_container = create_container
+        self._campaigns = {}
+        self._lock = threading.Lock()
+
+    def _weights(self, container_ids):
+        rates = [self.job_manager.observed_rate(cid) for cid in container_ids]
+        known = [r for r in rates if r]
+        default = sum(known) / len(known) if known else 1.0
+        return [r or default for r in rates]
+
+    def launch(self, recipients, container_ids=(), new_containers=0, environment=None):
+        container_ids = list(container_ids)
+        created = set()
+        for _ in range(new_containers):
+            container = self.create_container()
+            container_ids.append(container.id)
+            created.add(container.id)
+        if not container_ids:
+            raise ValueError("A fleet campaign needs at least one container")
+
+        shards = []
+        for container_id, shard in zip(container_ids, shard_recipients(recipients, self._weights(container_ids))):
+            if not shard:
+                continue
+            shard_path = f"{SHARD_DIR}/recipients-{uuid.uuid4().hex}.txt"
+            job = self.job_manager.submit(
+                container_id,
+                environment=dict(environment or {}, RECIPIENTS_FILE=shard_path),
+                prepare=self._preparer(shard, shard_path, wait=container_id in created),
+            )
+            shards.append({"container_id": container_id, "recipients": len(shard), "job": job})
+
+        campaign = FleetCampaign(shards)
+        with self._lock:
+            self._campaigns[campaign.id] = campaign
+        return campaign
+
+    @staticmethod
+    def _preparer(shard, shard_path, wait):
+        payload = ("\n".join(shard) + "\n").encode("utf-8")
+
+        def prepare(container):
+            if wait:
+                wait_until_ready(container)
+            directory, name = shard_path.rsplit("/", 1)
+            container.put_archive(directory, _tar_file(name, payload))
+        return prepare
+
+    def get(self, campaign_id):
+        return self._campaigns.get(campaign_id)
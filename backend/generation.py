@@ -0,0 +1,190 @@
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import requests
+
+SERVER = "https://puspeshd.pythonanywhere.com"
+GENERATION_BACKEND = os.environ.get("GENERATION_BACKEND", "remote")  # "stub" for offline testing
+GENERATION_TIMEOUT = 180  # seconds before a prompt is given up on
+POLL_INITIAL_DELAY = 1.0
+POLL_MAX_DELAY = 10.0
+POLL_BACKOFF = 1.5
+CACHE_SIZE = 256
+CACHE_TTL = 3600
+TICKET_TTL = 3600  # finished tickets are forgotten after this long
+
+
+class RemoteModelClient:
+    """The PythonAnywhere relay to the Colab model; it holds one prompt at a time."""
+
+    def __init__(self, server=SERVER, timeout=10):
+        self.server = server
+        self.timeout = timeout
+
+    def send(self, prompt):
+        requests.post(f"{self.server}/send_prompt", json={"prompt": prompt}, timeout=self.timeout).raise_for_status()
+
+    def poll(self):
+        """Return the result, or None while the model is still working."""
+        res = requests.get(f"{self.server}/get_result", timeout=self.timeout).json()
+        result = res.get("result")
+        return None if result == "pending" else result
+
+
+class LocalStubClient:
+    """Drop-in replacement for RemoteModelClient that answers locally after ``delay`` seconds."""
+
+    def __init__(self, delay=0.5, respond=None):
+        self.delay = delay
+        self.respond = respond or (lambda prompt: f"[stub] {prompt}")
+        self._prompt = None
+        self._sent_at = None
+
+    def send(self, prompt):
+        self._prompt, self._sent_at = prompt, time.monotonic()
+
+    def poll(self):
+        if self._prompt is None or time.monotonic() - self._sent_at < self.delay:
+            return None
+        return self.respond(self._prompt)
+
+
+def make_backend(name=GENERATION_BACKEND):
+    return LocalStubClient() if name == "stub" else RemoteModelClient()
+
+
+def wait_for_result(backend, timeout=GENERATION_TIMEOUT):
+    """Poll ``backend`` with exponential backoff until it answers; TimeoutError after ``timeout``."""
+    deadline = time.monotonic() + timeout
+    delay = POLL_INITIAL_DELAY
+    while True:
+        result = backend.poll()
+        if result is not None:
+            return result
+        if time.monotonic() + delay > deadline:
+            raise TimeoutError(f"No model response after {timeout}s")
+        time.sleep(delay)
+        delay = min(POLL_MAX_DELAY, delay * POLL_BACKOFF)
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after ``ttl`` seconds."""
+
+    def __init__(self, size=CACHE_SIZE, ttl=CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, stored_at = item
+            if time.monotonic() - stored_at > self.ttl:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+
+class Ticket:
+    def __init__(self, prompt):
+        self.id = uuid.uuid4().hex
+        self.prompt = prompt
+        self.status = "pending"
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.done = threading.Event()
+
+    def finish(self, result=None, error=None):
+        self.result, self.error = result, error
+        self.status = "error" if error else "done"
+        self.finished_at = time.time()
+        self.done.set()
+
+    def to_dict(self):
+        data = {"ticket": self.id, "status": self.status}
+        if self.status == "done":
+            data["result"] = self.result
+        elif self.status == "error":
+            data["error"] = self.error
+        return data
+
+
+class GenerationService:
+    """Queues prompts and answers them from one background poller.
+
+    Identical prompts share one in-flight ticket, and finished results are
+    served from an LRU cache with TTL, so repeats never reach the model.
+    """
+
+    def __init__(self, backend=None, cache=None, timeout=GENERATION_TIMEOUT):
+        self.backend = backend or make_backend()
+        self.cache = cache or TTLCache()
+        self.timeout = timeout
+        self._queue = queue.Queue()
+        self._tickets = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def submit(self, prompt):
+        ticket = Ticket(prompt)
+        cached = self.cache.get(prompt)
+        with self._lock:
+            self._expire_tickets()
+            if cached is None and prompt in self._inflight:
+                return self._inflight[prompt]
+            self._tickets[ticket.id] = ticket
+            if cached is not None:
+                ticket.finish(result=cached)
+                return ticket
+            self._inflight[prompt] = ticket
+            self._ensure_worker()
+        self._queue.put(ticket)
+        return ticket
+
+    def get(self, ticket_id):
+        return self._tickets.get(ticket_id)
+
+    def _expire_tickets(self):
+        cutoff = time.time() - TICKET_TTL
+        for ticket_id in [t.id for t in self._tickets.values() if t.finished_at and t.finished_at < cutoff]:
+            del self._tickets[ticket_id]
+
+    def _ensure_worker(self):
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._run, daemon=True)
+            self._worker.start()
+
+    def _run(self):
+        while True:
+            ticket = self._queue.get()
+            try:
+                self.backend.send(ticket.prompt)
+                result = wait_for_result(self.backend, self.timeout)
+                # The relay echoes the prompt back in front of the completion
+                result = result.replace(ticket.prompt, "")
+                self.cache.put(ticket.prompt, result)
+                ticket.finish(result=result)
+            except Exception as e:
+                print(f"❌ Generation failed: {e}")
+                ticket.finish(error=str(e))
+            finally:
+                with self._lock:
+                    self._inflight.pop(ticket.prompt, None)
@@ -0,0 +1,239 @@
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import METRICS_ENABLED, REGISTRY
+
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 8))
+JOB_CONCURRENCY_PER_CONTAINER = int(os.environ.get("JOB_CONCURRENCY_PER_CONTAINER", 1))
+JOB_HISTORY = 200  # finished jobs kept for status queries
+JOB_OUTPUT_TAIL = 200  # human-readable output lines kept per job
+INGEST_BATCH_SIZE = 200
+INGEST_INTERVAL = 1.0  # seconds between DB flushes while a job runs
+RECORD_PREFIX = "@@record "  # must match send_emails.RECORD_PREFIX
+METRICS_PREFIX = "@@metrics "  # must match send_emails.METRICS_PREFIX
+SEND_COMMAND = ["python3", "-u", "/send_emails.py"]
+
+DOCKER_EXEC_SECONDS = REGISTRY.histogram("docker_exec_seconds", "Docker exec time, including streaming its output",
+                                         ("op",))
+
+
+class CampaignJob:
+    """Progress of one send_emails.py run inside a container."""
+
+    def __init__(self, container_id, command, environment, prepare=None, max_concurrent=1):
+        self.id = uuid.uuid4().hex
+        self.container_id = container_id
+        self.max_concurrent = max_concurrent
+        self.command = command
+        self.environment = environment
+        self.prepare = prepare
+        self.status = "queued"
+        self.sent = self.failed = self.deferred = 0
+        self.exit_code = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = self.finished_at = None
+        self.output = deque(maxlen=JOB_OUTPUT_TAIL)
+        self.sender_metrics = None  # last cumulative @@metrics snapshot
+        self.version = 0
+        self.changed = threading.Condition()
+
+    @property
+    def done(self):
+        return self.status in ("finished", "failed")
+
+    def update(self, **fields):
+        with self.changed:
+            for key, value in fields.items():
+                setattr(self, key, value)
+            self.version += 1
+            self.changed.notify_all()
+
+    def count(self, status):
+        key = status.split(":", 1)[0]
+        # "unknown" (connection lost after DATA) is never retried, so it ends as failed
+        key = {"success": "sent", "failure": "failed", "deferred": "deferred"}.get(key, "failed")
+        setattr(self, key, getattr(self, key) + 1)
+
+    def snapshot(self, include_output=False):
+        end = self.finished_at or time.time()
+        elapsed = end - self.started_at if self.started_at else 0
+        processed = self.sent + self.failed + self.deferred
+        snap = {
+            "job_id": self.id,
+            "container_id": self.container_id,
+            "status": self.status,
+            "sent": self.sent,
+            "failed": self.failed,
+            "deferred": self.deferred,
+            "rate_per_sec": processed / elapsed if elapsed > 0 else 0.0,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "exit_code": self.exit_code,
+            "error": self.error,
+        }
+        if include_output:
+            snap["output"] = "\n".join(self.output)
+        return snap
+
+
+def iter_lines(chunks):
+    """Split a stream of byte chunks into decoded lines, carrying partial lines over."""
+    pending = b""
+    for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line.decode(errors="ignore")
+    if pending:
+        yield pending.decode(errors="ignore")
+
+
+class JobManager:
+    """Runs campaign jobs on a worker pool, at most ``per_container`` at a time per container.
+
+    Jobs wait in a FIFO queue per container and are only handed to the pool
+    once their container has a free slot, so a backlog for one container never
+    occupies workers that jobs for other containers could use.
+
+    ``ingest(container_id, records)`` is called with batches of sender records
+    while the job is running.
+    """
+
+    def __init__(self, client, ingest, workers=JOB_WORKERS, per_container=JOB_CONCURRENCY_PER_CONTAINER):
+        self.client = client
+        self.ingest = ingest
+        self.per_container = per_container
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._jobs = OrderedDict()
+        self._waiting = {}  # container id -> deque of queued jobs
+        self._running = {}  # container id -> number of jobs handed to the pool
+        self._rates = {}
+        self._lock = threading.Lock()
+
+    def submit(self, container_id, command=SEND_COMMAND, environment=None, prepare=None, max_concurrent=None):
+        """Queue a run; ``prepare(container)`` is called on the worker right before the exec.
+
+        The job starts once fewer than ``max_concurrent`` (default
+        ``per_container``) jobs are running on its container.
+        """
+        environment = dict(environment or {}, EMIT_RECORDS="1")
+        if METRICS_ENABLED:
+            environment["EMIT_METRICS"] = "1"
+        job = CampaignJob(container_id, command, environment, prepare, max(1, max_concurrent or self.per_container))
+        with self._lock:
+            self._jobs[job.id] = job
+            while len(self._jobs) > JOB_HISTORY:
+                oldest_id, oldest = next(iter(self._jobs.items()))
+                if not oldest.done:
+                    break
+                del self._jobs[oldest_id]
+            self._waiting.setdefault(container_id, deque()).append(job)
+            ready = self._take_ready(container_id)
+        self._start(ready)
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def observed_rate(self, container_id):
+        """Messages/sec of the container's last successful job, or None if it has none yet."""
+        return self._rates.get(container_id)
+
+    def _take_ready(self, container_id):
+        """Pop the container's queued jobs that fit its free slots (call with the lock held)."""
+        waiting = self._waiting.get(container_id)
+        ready = []
+        while waiting and self._running.get(container_id, 0) < waiting[0].max_concurrent:
+            ready.append(waiting.popleft())
+            self._running[container_id] = self._running.get(container_id, 0) + 1
+        if not waiting:
+            self._waiting.pop(container_id, None)
+        return ready
+
+    def _start(self, jobs):
+        for job in jobs:
+            self._executor.submit(self._run, job)
+
+    def _run(self, job):
+        try:
+            job.update(status="running", started_at=time.time())
+            try:
+                exit_code = self._execute(job)
+                job.update(status="finished" if exit_code == 0 else "failed",
+                           exit_code=exit_code, finished_at=time.time())
+                rate = job.snapshot()["rate_per_sec"]
+                if exit_code == 0 and rate > 0:
+                    self._rates[job.container_id] = rate
+            except Exception as e:
+                job.update(status="failed", error=str(e), finished_at=time.time())
+        finally:
+            with self._lock:
+                self._running[job.container_id] -= 1
+                if not self._running[job.container_id]:
+                    del self._running[job.container_id]
+                ready = self._take_ready(job.container_id)
+            self._start(ready)
+
+    def _execute(self, job):
+        container = self.client.containers.get(job.container_id)
+        if container.status != "running":
+            container.start()
+        if job.prepare is not None:
+            job.prepare(container)
+        with DOCKER_EXEC_SECONDS.time(op="campaign"):
+            exec_id = self.client.api.exec_create(container.id, job.command, environment=job.environment)["Id"]
+            stream = self.client.api.exec_start(exec_id, stream=True)
+            self._consume(job, stream)
+        return self.client.api.exec_inspect(exec_id)["ExitCode"]
+
+    def _consume(self, job, stream):
+        batch, last_flush = [], time.monotonic()
+        for line in iter_lines(stream):
+            if line.startswith(METRICS_PREFIX):
+                try:
+                    snapshot = json.loads(line[len(METRICS_PREFIX):])
+                except ValueError:
+                    continue
+                REGISTRY.merge_sender_snapshot(snapshot, job.sender_metrics, container=job.container_id)
+                job.sender_metrics = snapshot
+            elif line.startswith(RECORD_PREFIX):
+                try:
+                    record = json.loads(line[len(RECORD_PREFIX):])
+                except ValueError:
+                    continue
+                batch.append(record)
+                with job.changed:
+                    job.count(record.get("status", ""))
+            else:
+                job.output.append(line)
+            if len(batch) >= INGEST_BATCH_SIZE or time.monotonic() - last_flush >= INGEST_INTERVAL:
+                self._flush(job, batch)
+                batch, last_flush = [], time.monotonic()
+        self._flush(job, batch)
+
+    def _flush(self, job, batch):
+        if batch:
+            self.ingest(job.container_id, batch)
+        job.update()
+
+
+def iter_job_events(job, keepalive=15):
+    """Yield a snapshot each time the job changes (None as a keepalive) until it is done."""
+    seen = -1
+    while True:
+        with job.changed:
+            job.changed.wait_for(lambda: job.version != seen, timeout=keepalive)
+            changed = job.version != seen
+            seen = job.version
+            snapshot = job.snapshot() if changed else None
+            done = job.done
+        yield snapshot
+        if done:
+            break
@@ -0,0 +1,179 @@
+import binascii
+import codecs
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from email.header import decode_header, make_header
+from email.parser import BytesHeaderParser
+
+SNIPPET_CHARS = 100
+MAX_HTML_BYTES = 1024 * 1024  # decoded HTML kept per message
+MAX_MULTIPART_DEPTH = 5
+BATCH_PROCESS_THRESHOLD = 200  # smaller batches are parsed inline
+
+# compat32 skips the header registry, which would cost more than the whole body decode
+_header_parser = BytesHeaderParser()
+_HEADER_END_RE = re.compile(rb"\r?\n\r?\n")
+# "Received: from ... by localhost.localdomain (Postfix) with ESMTP id 4YbC2x0Kz9z1 for <...>; <date>"
+_POSTFIX_ID_RE = re.compile(r"\(Postfix[^)]*\)[^;]*?\bid ([0-9A-Za-z]+)")
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _split_headers(raw):
+    """Split raw bytes into (header block, body) at the first blank line."""
+    if raw.startswith((b"\r\n", b"\n")):
+        return b"", raw[raw.index(b"\n") + 1:]
+    match = _HEADER_END_RE.search(raw)
+    if not match:
+        return raw, b""
+    return raw[:match.end()], raw[match.end():]
+
+
+def _header(msg, name):
+    """Header value with RFC 2047 encoded-words decoded, or None if absent."""
+    value = msg.get(name)
+    if value is None:
+        return None
+    try:
+        return str(make_header(decode_header(value)))
+    except Exception:
+        return str(value)
+
+
+def _queue_id(msg):
+    """Queue id assigned by the Postfix that accepted the message (its topmost Received header)."""
+    for received in msg.get_all('Received') or ():
+        match = _POSTFIX_ID_RE.search(str(received))
+        if match:
+            return match.group(1)
+    return None
+
+
+def _iter_parts(body, boundary):
+    delimiter = b"--" + boundary.encode("ascii", errors="ignore")
+    for piece in body.split(delimiter)[1:]:
+        if piece.startswith(b"--"):
+            break
+        newline = piece.find(b"\n")
+        piece = piece[newline + 1:] if newline >= 0 else b""
+        if piece.endswith(b"\r\n"):
+            piece = piece[:-2]
+        elif piece.endswith(b"\n"):
+            piece = piece[:-1]
+        yield piece
+
+
+def _find_bodies(msg, body, depth=0):
+    """Locate the first text/html and text/plain leaves without decoding anything.
+
+    Returns (html, plain), each a (headers, encoded body) pair or None.
+    """
+    if msg.get_content_maintype() == "multipart":
+        boundary = msg.get_boundary()
+        if not boundary or depth >= MAX_MULTIPART_DEPTH:
+            return None, None
+        html = plain = None
+        for part in _iter_parts(body, boundary):
+            part_head, part_body = _split_headers(part)
+            part_html, part_plain = _find_bodies(_header_parser.parsebytes(part_head), part_body, depth + 1)
+            html = html or part_html
+            plain = plain or part_plain
+            if html and plain:
+                break
+        return html, plain
+    ctype = msg.get_content_type()
+    if ctype == "text/html":
+        return (msg, body), None
+    # A single-part message of any other type still provides the snippet
+    if ctype == "text/plain" or depth == 0:
+        return None, (msg, body)
+    return None, None
+
+
+def _decode_transfer(body, encoding, limit):
+    """Undo the Content-Transfer-Encoding, decoding only enough input for ``limit`` bytes."""
+    encoding = (encoding or "7bit").strip().lower()
+    if encoding == "base64":
+        needed = (limit + 2) // 3 * 4
+        # Encoders wrap at 76 characters; allow for the line breaks before stripping them
+        data = b"".join(body[:needed * 80 // 76 + 80].split())[:needed]
+        try:
+            decoded = binascii.a2b_base64(data[:len(data) // 4 * 4])
+        except binascii.Error:
+            decoded = b""
+    elif encoding == "quoted-printable":
+        # Each decoded byte takes at most 3 encoded bytes, plus soft line breaks
+        decoded = binascii.a2b_qp(body[:limit * 4])
+    else:
+        decoded = body
+    return decoded[:limit]
+
+
+def _to_text(data, charset, truncated):
+    try:
+        decoder = codecs.getincrementaldecoder(charset or "utf-8")(errors="replace")
+    except LookupError:
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    # Not final when truncated: a multi-byte character cut in half is dropped, not mangled
+    return decoder.decode(data, final=not truncated)
+
+
+def _decode_part(part, limit):
+    msg, body = part
+    data = _decode_transfer(body, msg.get("Content-Transfer-Encoding"), limit)
+    return _to_text(data, msg.get_content_charset(), truncated=len(data) >= limit)
+
+
+def parse_mail(raw_content, max_html_bytes=MAX_HTML_BYTES, snippet_chars=SNIPPET_CHARS):
+    """Parse a raw message into the fields kept in email_logs.
+
+    Headers are parsed on their own; of the body only the first HTML part
+    (capped at ``max_html_bytes``) and the start of the first plain-text part
+    are ever decoded.
+    """
+    head, body = _split_headers(raw_content)
+    msg = _header_parser.parsebytes(head)
+    mail_info = {
+        'from': _header(msg, 'From'),
+        'to': _header(msg, 'To'),
+        'subject': _header(msg, 'Subject'),
+        'date': _header(msg, 'Date'),
+        'queue_id': _queue_id(msg),
+        # Added by local(8) with the envelope recipient, which To: may not show
+        'delivered_to': (msg.get('Delivered-To') or '').strip().lower() or None,
+        'body_snippet': '',
+        'body_html': '',
+        'status': 'success'
+    }
+
+    html, plain = _find_bodies(msg, body)
+    if html:
+        mail_info['body_html'] = _decode_part(html, max_html_bytes)
+    if plain:
+        # Up to 4 bytes per character in UTF-8
+        mail_info['body_snippet'] = _decode_part(plain, snippet_chars * 4)[:snippet_chars]
+    elif html:
+        mail_info['body_snippet'] = mail_info['body_html'][:snippet_chars]
+    return mail_info
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Forking the backend, which runs many threads (event watcher, log followers,
+            # job workers), can deadlock on inherited locks; start from a clean forkserver
+            _pool = ProcessPoolExecutor(max_workers=os.cpu_count(),
+                                        mp_context=multiprocessing.get_context("forkserver"))
+        return _pool
+
+
+def parse_mail_batch(raw_messages):
+    """Parse many messages, spreading large batches over a shared process pool."""
+    if len(raw_messages) < BATCH_PROCESS_THRESHOLD or (os.cpu_count() or 1) < 2:
+        return [parse_mail(raw) for raw in raw_messages]
+    chunksize = max(1, len(raw_messages) // ((os.cpu_count() or 1) * 4))
+    return list(_get_pool().map(parse_mail, raw_messages, chunksize=chunksize))
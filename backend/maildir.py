@@ -0,0 +1,102 @@
+import io
+import re
+import tarfile
+
+from metrics import REGISTRY
+
+MAILDIR_MEMBER_RE = re.compile(r"^(user\d+)/Maildir/new/([^/]+)$")
+MAILDIR_USEC_RE = re.compile(r"M(\d{1,6})(?!\d)")
+EXEC_PATHS_PER_CALL = 500  # keeps exec command lines well below ARG_MAX
+
+DOCKER_EXEC_SECONDS = REGISTRY.histogram("docker_exec_seconds", "Docker exec time, including streaming its output",
+                                         ("op",))
+
+
+class ChunkStream(io.RawIOBase):
+    """Read-only file object over an iterator of byte chunks, e.g. a Docker exec stream."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buf = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buf:
+            try:
+                self._buf = next(self._chunks)
+            except StopIteration:
+                return 0
+        n = min(len(b), len(self._buf))
+        b[:n] = self._buf[:n]
+        self._buf = self._buf[n:]
+        return n
+
+
+def _tar_command(paths):
+    # Paths go in as positional args, never through the shell's parser. stderr
+    # is discarded so missing files don't get multiplexed into the tar stream.
+    return ["sh", "-c", 'cd /home && tar -cf - "$@" 2>/dev/null', "sh"] + list(paths)
+
+
+def iter_tar_members(container, paths):
+    """Yield (member name, bytes) for regular files under ``paths`` (relative to /home).
+
+    The container packs everything with a single ``tar`` exec and the archive is
+    parsed incrementally while it streams, so memory stays bounded by one message.
+    """
+    with DOCKER_EXEC_SECONDS.time(op="tar"):
+        result = container.exec_run(_tar_command(paths), stream=True)
+        with tarfile.open(fileobj=io.BufferedReader(ChunkStream(result.output)), mode="r|") as tar:
+            for member in tar:
+                if member.isfile():
+                    yield member.name, tar.extractfile(member).read()
+
+
+def list_maildir_new(container, users):
+    """Return the set of (user, filename) currently in the users' Maildir/new, in one exec."""
+    dirs = [f"{user}/Maildir/new" for user in users]
+    with DOCKER_EXEC_SECONDS.time(op="find"):
+        _, output = container.exec_run(
+            ["sh", "-c", 'cd /home && find "$@" -maxdepth 1 -type f 2>/dev/null', "sh"] + dirs)
+    listing = set()
+    for line in output.decode(errors="ignore").splitlines():
+        match = MAILDIR_MEMBER_RE.match(line.strip())
+        if match:
+            listing.add((match.group(1), match.group(2)))
+    return listing
+
+
+def iter_maildir_files(container, files):
+    """Yield (user, filename, raw bytes) for specific (user, filename) pairs in Maildir/new."""
+    paths = [f"{user}/Maildir/new/{filename}" for user, filename in files]
+    for i in range(0, len(paths), EXEC_PATHS_PER_CALL):
+        for name, raw in iter_tar_members(container, paths[i:i + EXEC_PATHS_PER_CALL]):
+            match = MAILDIR_MEMBER_RE.match(name)
+            if match:
+                yield match.group(1), match.group(2), raw
+
+
+def move_to_cur(container, files):
+    """Move processed messages from new/ to cur/ with the ':2,' info suffix, as Maildir readers do."""
+    paths = [f"{user}/Maildir/new/{filename}" for user, filename in files]
+    script = 'cd /home && for f in "$@"; do mv "$f" "${f%/new/*}/cur/${f##*/}:2,"; done'
+    for i in range(0, len(paths), EXEC_PATHS_PER_CALL):
+        with DOCKER_EXEC_SECONDS.time(op="move"):
+            container.exec_run(["sh", "-c", script, "sh"] + paths[i:i + EXEC_PATHS_PER_CALL])
+
+
+def maildir_timestamp(filename):
+    """Delivery time encoded in a Maildir filename ("<seconds>.<unique>.<host>").
+
+    The microseconds come from the ``M<usec>`` field of the unique part when
+    the delivery agent wrote one, as Postfix's local(8) does.
+    """
+    seconds, _, rest = filename.partition(".")
+    try:
+        timestamp = float(seconds)
+    except ValueError:
+        return None
+    match = MAILDIR_USEC_RE.search(rest.partition(".")[0])
+    return timestamp + int(match.group(1)) / 1e6 if match else timestamp
@@ -0,0 +1,153 @@
+import calendar
+import re
+import threading
+import time
+from collections import deque
+
+from jobs import iter_lines
+from metrics import REGISTRY
+
+LOG_TAIL = 1000  # raw lines kept per container for the plain log view
+LOG_FIRST_LINES_WAIT = 1.0  # seconds a request waits for a brand-new follower
+LOG_INGEST_BATCH_SIZE = 500
+LOG_INGEST_INTERVAL = 1.0  # seconds between DB flushes
+
+# "<queue id>: to=<rcpt>, [orig_to=<...>, ]relay=..., delay=0.05, delays=..., dsn=2.0.0, status=sent (detail)"
+DELIVERY_RE = re.compile(
+    r"postfix(?:/[\w.-]+)*\[\d+\]: (?P<queue_id>[0-9A-Za-z]+): to=<(?P<recipient>[^>]*)>"
+    r"(?:, orig_to=<[^>]*>)?(?:, relay=(?P<relay>[^,]*))?.*?, delay=(?P<delay>[\d.]+)"
+    r".*?, dsn=(?P<dsn>[\d.]+), status=(?P<status>\w+)(?: \((?P<detail>.*)\))?"
+)
+
+LOG_LINES_TOTAL = REGISTRY.counter("postfix_log_lines_total", "Container log lines read by the ingester",
+                                   ("kind",))
+
+
+def parse_docker_timestamp(value):
+    """'2025-10-18T18:32:31.123456789Z' -> epoch seconds (Docker log timestamps are UTC)."""
+    seconds = calendar.timegm(time.strptime(value[:19], "%Y-%m-%dT%H:%M:%S"))
+    fraction = value[19:].rstrip("Z")
+    return seconds + (float(fraction) if fraction.startswith(".") else 0.0)
+
+
+def parse_postfix_line(line):
+    """Structured record for a Postfix delivery attempt line, or None for any other line."""
+    match = DELIVERY_RE.search(line)
+    if not match:
+        return None
+    return {
+        "queue_id": match.group("queue_id"),
+        "recipient": match.group("recipient").lower(),
+        "status": match.group("status"),
+        "delay": float(match.group("delay")),
+        "dsn": match.group("dsn"),
+        "relay": match.group("relay"),
+        "detail": match.group("detail"),
+    }
+
+
+class PostfixLogIngester:
+    """Follows each running container's log stream in a background thread.
+
+    Postfix delivery lines are parsed into records and stored in batches via
+    ``store(container_id, records)``; every line also lands in a per-container
+    ring buffer for the plain log view. Records are flushed once a batch fills
+    up and by a flusher thread every ``LOG_INGEST_INTERVAL`` seconds, so a quiet
+    stream never holds records back. A follower resumes from ``resume_from(
+    container_id)`` (the newest stored timestamp), so restarts don't re-ingest
+    history, and ends by itself when the container stops.
+    """
+
+    def __init__(self, client, store, resume_from, tail=LOG_TAIL):
+        self.client = client
+        self.store = store
+        self.resume_from = resume_from
+        self.tail_size = tail
+        self._tails = {}
+        self._first_lines = {}
+        self._threads = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flusher = None
+
+    def track(self, container_id):
+        """Start following this container unless a follower is already running."""
+        with self._lock:
+            thread = self._threads.get(container_id)
+            if thread is not None and thread.is_alive():
+                return
+            self._tails.setdefault(container_id, deque(maxlen=self.tail_size))
+            self._first_lines.setdefault(container_id, threading.Event())
+            thread = threading.Thread(target=self._follow, args=(container_id,), daemon=True)
+            self._threads[container_id] = thread
+            thread.start()
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+                self._flusher.start()
+
+    def _add(self, container_id, record):
+        with self._lock:
+            pending = self._pending.setdefault(container_id, [])
+            pending.append(record)
+            full = len(pending) >= LOG_INGEST_BATCH_SIZE
+        if full:
+            self.flush(container_id)
+
+    def flush(self, container_id=None):
+        """Store pending records for one container, or for all of them."""
+        with self._flush_lock:
+            with self._lock:
+                ids = [container_id] if container_id is not None else list(self._pending)
+                batches = [(cid, self._pending.pop(cid, None)) for cid in ids]
+            for cid, batch in batches:
+                if batch:
+                    try:
+                        self.store(cid, batch)
+                    except Exception as e:
+                        print(f"❌ Failed to store {len(batch)} log records for {cid[:12]}: {e}")
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(LOG_INGEST_INTERVAL)
+            self.flush()
+
+    def _follow(self, container_id):
+        tail = self._tails[container_id]
+        first_lines = self._first_lines[container_id]
+        since = self.resume_from(container_id)
+        try:
+            container = self.client.containers.get(container_id)
+            # Without a stored position only the recent tail is replayed, not the whole history
+            kwargs = {"since": since} if since else {"tail": self.tail_size}
+            stream = container.logs(stream=True, follow=True, timestamps=True, **kwargs)
+            for line in iter_lines(stream):
+                stamp, _, text = line.partition(" ")
+                tail.append(text)
+                first_lines.set()
+                record = parse_postfix_line(text)
+                LOG_LINES_TOTAL.inc(kind="delivery" if record else "other")
+                if record:
+                    try:
+                        record["timestamp"] = parse_docker_timestamp(stamp)
+                    except ValueError:
+                        record["timestamp"] = time.time()
+                    self._add(container_id, record)
+        except Exception as e:
+            print(f"⚠️ Log stream for {container_id[:12]} ended: {e}")
+        finally:
+            self.flush(container_id)
+            first_lines.set()
+
+    def tail(self, container_id, lines=200, wait=LOG_FIRST_LINES_WAIT):
+        """The last ``lines`` raw log lines, waiting briefly if the follower has just started."""
+        self.track(container_id)
+        self._first_lines[container_id].wait(wait)
+        return list(self._tails[container_id])[-lines:]
+
+    def forget(self, container_id):
+        with self._lock:
+            self._tails.pop(container_id, None)
+            self._first_lines.pop(container_id, None)
+            self._threads.pop(container_id, None)
+            self._pending.pop(container_id, None)
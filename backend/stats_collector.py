@@ -0,0 +1,91 @@
+import threading
+import time
+from collections import deque
+
+STATS_HISTORY = 300  # samples kept per container; Docker streams about one per second
+STATS_FIRST_SAMPLE_WAIT = 2.5  # seconds a request waits for a brand-new subscription
+
+
+def summarize_stats(usage):
+    """Reduce one raw Docker stats document to the numbers the dashboard charts."""
+    cpu = usage.get('cpu_stats', {})
+    precpu = usage.get('precpu_stats', {})
+    cpu_delta = cpu.get('cpu_usage', {}).get('total_usage', 0) - precpu.get('cpu_usage', {}).get('total_usage', 0)
+    system_delta = cpu.get('system_cpu_usage', 0) - precpu.get('system_cpu_usage', 0)
+    online_cpus = cpu.get('online_cpus') or len(cpu.get('cpu_usage', {}).get('percpu_usage') or []) or 1
+    cpu_percent = (cpu_delta / system_delta) * online_cpus * 100.0 if system_delta > 0 else 0.0
+
+    mem_usage = usage.get('memory_stats', {}).get('usage', 0)
+    mem_limit = usage.get('memory_stats', {}).get('limit', 0)
+    mem_percent = mem_usage / mem_limit * 100.0 if mem_limit > 0 else 0.0
+
+    networks = (usage.get('networks') or {}).values()
+    block_io = usage.get('blkio_stats', {}).get('io_service_bytes_recursive') or []
+    return {
+        "timestamp": time.time(),
+        "cpu_percent": cpu_percent,
+        "memory_usage": mem_usage,
+        "memory_limit": mem_limit,
+        "memory_percent": mem_percent,
+        "network_rx_bytes": sum(n.get('rx_bytes', 0) for n in networks),
+        "network_tx_bytes": sum(n.get('tx_bytes', 0) for n in networks),
+        "block_read_bytes": sum(b.get('value', 0) for b in block_io if b.get('op', '').lower() == 'read'),
+        "block_write_bytes": sum(b.get('value', 0) for b in block_io if b.get('op', '').lower() == 'write'),
+    }
+
+
+class StatsCollector:
+    """One background stats stream per running container, buffered in memory.
+
+    Each subscription appends summarised samples to a fixed-size ring buffer
+    and ends by itself when the container stops, so requests only read memory.
+    """
+
+    def __init__(self, client, history=STATS_HISTORY):
+        self.client = client
+        self.history_size = history
+        self._buffers = {}
+        self._first_sample = {}
+        self._threads = {}
+        self._lock = threading.Lock()
+
+    def track(self, container_id):
+        """Start a subscription for this container unless one is already running."""
+        with self._lock:
+            thread = self._threads.get(container_id)
+            if thread is not None and thread.is_alive():
+                return
+            self._buffers.setdefault(container_id, deque(maxlen=self.history_size))
+            self._first_sample.setdefault(container_id, threading.Event())
+            thread = threading.Thread(target=self._follow, args=(container_id,), daemon=True)
+            self._threads[container_id] = thread
+            thread.start()
+
+    def _follow(self, container_id):
+        buffer = self._buffers[container_id]
+        try:
+            container = self.client.containers.get(container_id)
+            for usage in container.stats(stream=True, decode=True):
+                buffer.append(summarize_stats(usage))
+                self._first_sample[container_id].set()
+        except Exception as e:
+            print(f"⚠️ Stats stream for {container_id[:12]} ended: {e}")
+
+    def latest(self, container_id, wait=STATS_FIRST_SAMPLE_WAIT):
+        """Most recent sample, waiting briefly if the subscription has produced none yet."""
+        self.track(container_id)
+        buffer = self._buffers[container_id]
+        if not buffer:
+            self._first_sample[container_id].wait(wait)
+        return buffer[-1] if buffer else None
+
+    def history(self, container_id, seconds):
+        """Samples from the last ``seconds`` seconds, oldest first."""
+        cutoff = time.time() - seconds
+        return [s for s in list(self._buffers.get(container_id, ())) if s["timestamp"] >= cutoff]
+
+    def forget(self, container_id):
+        with self._lock:
+            self._buffers.pop(container_id, None)
+            self._first_sample.pop(container_id, None)
+            self._threads.pop(container_id, None)
@@ -0,0 +1,119 @@
+"""Benchmark: legacy parse_mail_content vs backend/mail_parser over a synthetic Maildir.
+
+Usage: python3 benchmarks/bench_mail_parser.py [--messages N] [--html-kb K]
+"""
+import argparse
+import email
+import os
+import random
+import sys
+import tempfile
+import time
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from mail_parser import parse_mail, parse_mail_batch  # noqa: E402
+
+
+def legacy_parse_mail_content(raw_content):
+    """parse_mail_content as it was before mail_parser existed."""
+    msg = email.message_from_bytes(raw_content)
+    mail_info = {
+        'from': msg.get('From'),
+        'to': msg.get('To'),
+        'subject': msg.get('Subject'),
+        'date': msg.get('Date'),
+        'body_snippet': '',
+        'body_html': '',
+        'status': 'success'
+    }
+
+    if msg.is_multipart():
+        for part in msg.walk():
+            ctype = part.get_content_type()
+            if ctype == 'text/html':
+                mail_info['body_html'] = part.get_payload(decode=True).decode(errors='ignore')
+            elif ctype == 'text/plain' and not mail_info['body_snippet']:
+                mail_info['body_snippet'] = part.get_payload(decode=True)[:100].decode(errors='ignore')
+    else:
+        ctype = msg.get_content_type()
+        payload = msg.get_payload(decode=True)
+        if ctype == 'text/html':
+            mail_info['body_html'] = payload.decode(errors='ignore')
+            mail_info['body_snippet'] = mail_info['body_html'][:100]
+        else:
+            mail_info['body_snippet'] = payload[:100].decode(errors='ignore')
+
+    return mail_info
+
+
+def make_message(i, html_kb):
+    """One synthetic message; the mix mirrors what campaigns and test tools deliver."""
+    html = "<html><body>" + ("<p>Hola usuario — oferta número %d</p>\n" % i) * (html_kb * 1024 // 40) + "</body></html>"
+    kind = i % 4
+    if kind == 0:
+        msg = MIMEText(html, "html")                      # what send_emails.py sends
+    elif kind == 1:
+        msg = MIMEText("Texto plano de prueba con acentos: áéíóú " * 20, "plain")
+    elif kind == 2:
+        msg = MIMEMultipart("alternative")
+        msg.attach(MIMEText("Versión en texto plano", "plain"))
+        msg.attach(MIMEText(html, "html"))
+    else:
+        msg = MIMEMultipart("mixed")
+        alt = MIMEMultipart("alternative")
+        alt.attach(MIMEText("Resumen", "plain"))
+        alt.attach(MIMEText(html, "html"))
+        msg.attach(alt)
+        msg.attach(MIMEApplication(random.randbytes(64 * 1024), Name="adjunto.bin"))
+    msg["Subject"] = "=?utf-8?b?Qm9sZXTDrW4gbsK6IA==?=%d" % i
+    msg["From"] = "base@localhost"
+    msg["To"] = f"user{i % 50 + 1}@localhost"
+    msg["Date"] = "Mon, 13 Oct 2025 10:00:00 +0000"
+    return msg.as_bytes()
+
+
+def build_maildir(root, n, html_kb):
+    new_dir = os.path.join(root, "user1", "Maildir", "new")
+    os.makedirs(new_dir)
+    for i in range(n):
+        with open(os.path.join(new_dir, f"{1700000000 + i}.V801I{i}.bench"), "wb") as f:
+            f.write(make_message(i, html_kb))
+    return new_dir
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--html-kb", type=int, default=32)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        new_dir = build_maildir(root, args.messages, args.html_kb)
+        corpus = []
+        for name in sorted(os.listdir(new_dir)):
+            with open(os.path.join(new_dir, name), "rb") as f:
+                corpus.append(f.read())
+
+    size_mb = sum(map(len, corpus)) / 1e6
+    runs = (
+        ("legacy", lambda: [legacy_parse_mail_content(raw) for raw in corpus]),
+        ("fast", lambda: [parse_mail(raw) for raw in corpus]),
+        ("fast-batch", lambda: parse_mail_batch(corpus)),
+    )
+    results = {}
+    for name, run in runs:
+        start = time.perf_counter()
+        run()
+        results[name] = time.perf_counter() - start
+        print(f"{name:>10}: {results[name]:8.3f}s  {len(corpus) / results[name]:10.0f} msg/s")
+    print(f"  corpus: {len(corpus)} messages, {size_mb:.1f} MB; "
+          f"speedup fast {results['legacy'] / results['fast']:.1f}x, "
+          f"batch {results['legacy'] / results['fast-batch']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Micro-benchmark: per-recipient message rendering, legacy path vs compiled templates.
+
+Usage: python3 benchmarks/bench_templates.py [--recipients N] [--html-kb K]
+"""
+import argparse
+import os
+import sys
+import time
+from email.mime.text import MIMEText
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import send_emails  # noqa: E402
+
+
+def make_html(size_kb):
+    """A newsletter-like design of roughly ``size_kb`` KiB with a couple of placeholders."""
+    row = ('<tr><td style="padding:8px;font-family:Arial">Producto destacado — '
+           'descripción larga del artículo con acentos y ñ</td></tr>\n')
+    rows = row * max(1, (size_kb * 1024) // len(row))
+    return f"<html><body><h1>Hola {{{{user}}}}</h1><table>\n{rows}</table>" \
+           f"<p>Enviado a {{{{email}}}}</p></body></html>"
+
+
+def legacy_render(tpl_html, tpl_name, recipient):
+    body_content = tpl_html.replace("{{user}}", recipient.split("@")[0])
+    msg = MIMEText(body_content, "html")
+    msg["Subject"] = tpl_name
+    msg["From"] = send_emails.BASE_EMAIL
+    msg["To"] = recipient
+    return msg.as_string(), body_content[:200]
+
+
+def compiled_render(tpl_html, tpl_name, recipient):
+    compiled = send_emails.compile_template(tpl_html, tpl_name)
+    values = send_emails.template_variables(recipient)
+    return compiled.render(recipient, values), compiled.render_text(values, limit=200)
+
+
+def bench(fn, tpl_html, recipients):
+    start = time.perf_counter()
+    for recipient in recipients:
+        fn(tpl_html, "Boletín", recipient)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--recipients", type=int, default=2000)
+    parser.add_argument("--html-kb", type=int, default=64)
+    args = parser.parse_args()
+
+    tpl_html = make_html(args.html_kb)
+    recipients = [f"user{i}@localhost" for i in range(1, args.recipients + 1)]
+
+    results = {name: bench(fn, tpl_html, recipients)
+               for name, fn in (("legacy", legacy_render), ("compiled", compiled_render))}
+    for name, elapsed in results.items():
+        per_msg_us = elapsed / len(recipients) * 1e6
+        print(f"{name:>9}: {elapsed:8.3f}s  {per_msg_us:9.1f} µs/msg  {len(recipients) / elapsed:10.0f} msg/s")
+    print(f"  speedup: {results['legacy'] / results['compiled']:.1f}x "
+          f"({len(tpl_html) // 1024} KiB template, {len(recipients)} recipients)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,372 @@
+"""End-to-end throughput benchmarks for the sender and the backend's hot paths.
+
+Each stage runs in its own subprocess against a throwaway SQLite database and
+an in-process SMTP sink, and reports messages/sec, p50/p99 latency and the
+stage's peak RSS. Results are written as JSON so runs of two revisions can be
+compared:
+
+    python3 benchmarks/run_benchmarks.py --scale 10k --output before.json
+    python3 benchmarks/run_benchmarks.py --scale 10k --compare before.json
+
+Stages:
+    send    send_emails.send_emails() into the SMTP sink; latency is record
+            creation to the sink accepting the recipient
+    parse   backend/mail_parser.parse_mail per message, and the removed
+            parse_mail_content (bench_mail_parser.legacy_parse_mail_content)
+            on the same corpus as parse_legacy
+    db      save_email_logs_to_db in ingest-sized batches; latency per batch
+    reconcile
+            reconcile_deliveries over sender records joined with Postfix log
+            records and Maildir arrivals, first and incremental runs
+    routes  /containers/emails pages and export, /mails full, lite and 304,
+            through the Flask test client
+"""
+import argparse
+import contextlib
+import itertools
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+BACKEND_DIR = os.path.join(REPO_DIR, "backend")
+STAGES = ("send", "parse", "db", "reconcile", "routes")
+RESULT_PREFIX = "@@result "
+CONTAINER_ID = "bench"
+PARSE_CORPUS_SIZE = 512  # distinct messages, cycled up to --scale
+MAILS_REQUESTS = 500
+TEMPLATE_COUNT = 20
+
+PERSONAL_HTML = "<html><body><h1>Hola {{user}}</h1>" + "<p>Oferta especial para {{email}}.</p>\n" * 200 + "</body></html>"
+STATIC_HTML = "<html><body>" + "<p>Boletín semanal para todos los usuarios.</p>\n" * 200 + "</body></html>"
+TEMPLATES = [
+    {"id": "1", "name": "Personal", "html": PERSONAL_HTML},
+    {"id": "2", "name": "Static", "html": STATIC_HTML},
+]
+
+
+def parse_scale(value):
+    """'1000', '10k' or '1M' -> int."""
+    value = value.strip().lower()
+    multiplier = {"k": 1_000, "m": 1_000_000}.get(value[-1:], 1)
+    return int(float(value.rstrip("km")) * multiplier)
+
+
+def summarize(messages, seconds, latencies=()):
+    latencies = sorted(latencies)
+
+    def percentile(p):
+        if not latencies:
+            return None
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 3)
+
+    return {
+        "messages": messages,
+        "seconds": round(seconds, 4),
+        "msgs_per_sec": round(messages / seconds, 1) if seconds else None,
+        "p50_ms": percentile(0.50),
+        "p99_ms": percentile(0.99),
+    }
+
+
+def recipients(n):
+    return [f"user{i}@localhost" for i in range(1, n + 1)]
+
+
+# --- stages (run inside the child process) ---------------------------------
+
+def stage_send(scale, workdir):
+    sys.path.insert(0, REPO_DIR)
+    import send_emails
+    from smtp_sink import SMTPSink
+
+    send_emails.LOG_FILE_PATH = os.path.join(workdir, "email_records.jsonl")
+    send_emails.RETRY_QUEUE_PATH = os.path.join(workdir, "email_retry_queue.jsonl")
+    send_emails.SEND_RATE = 0
+    send_emails.get_templates = lambda: TEMPLATES
+    with SMTPSink() as sink:
+        send_emails.SMTP_HOST, send_emails.SMTP_PORT = sink.host, sink.port
+        start = time.perf_counter()
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            send_emails.send_emails(recipients(scale))
+        seconds = time.perf_counter() - start
+        latencies = [
+            sink.arrivals[record["to"]] - record["timestamp"]
+            for record in send_emails.iter_email_logs(send_emails.LOG_FILE_PATH, send_emails.LOG_KEEP_SEGMENTS)
+            if record["to"] in sink.arrivals
+        ]
+    return {"send": summarize(len(latencies), seconds, latencies)}
+
+
+def stage_parse(scale, workdir):
+    sys.path.insert(0, BACKEND_DIR)
+    from bench_mail_parser import legacy_parse_mail_content, make_message
+    from mail_parser import parse_mail
+
+    corpus = [make_message(i, 16) for i in range(min(scale, PARSE_CORPUS_SIZE))]
+    results = {}
+    for name, parse in (("parse", parse_mail), ("parse_legacy", legacy_parse_mail_content)):
+        latencies = []
+        start = time.perf_counter()
+        for raw in itertools.islice(itertools.cycle(corpus), scale):
+            t0 = time.perf_counter()
+            parse(raw)
+            latencies.append(time.perf_counter() - t0)
+        results[name] = summarize(scale, time.perf_counter() - start, latencies)
+    return results
+
+
+def _records(scale):
+    """Half sender records (template reference), half harvested ones (full body_html)."""
+    now = time.time()
+    for i, to in enumerate(recipients(scale)):
+        user = to.split("@")[0]
+        record = {"to": to, "subject": "Personal", "status": "success",
+                  "timestamp": now - i * 0.001, "body_snippet": f"Hola {user}"}
+        if i % 2:
+            record["body_html"] = PERSONAL_HTML.replace("{{user}}", user).replace("{{email}}", to)
+        else:
+            record["template_id"] = "1"
+            record["template_vars"] = {"user": user, "email": to}
+        yield record
+
+
+def _seed_templates(save_template):
+    save_template("Personal", PERSONAL_HTML, json.dumps({"rows": []}), time.time())
+    save_template("Static", STATIC_HTML, json.dumps({"rows": []}), time.time())
+    for i in range(TEMPLATE_COUNT - 2):
+        save_template(f"Template {i}", STATIC_HTML, json.dumps({"rows": [{"n": i}] * 50}), time.time())
+
+
+def stage_db(scale, workdir):
+    sys.path.insert(0, BACKEND_DIR)
+    import db
+    from jobs import INGEST_BATCH_SIZE
+
+    db.init_db()
+    _seed_templates(db.save_template)
+    records = _records(scale)
+    latencies = []
+    start = time.perf_counter()
+    while True:
+        batch = list(itertools.islice(records, INGEST_BATCH_SIZE))
+        if not batch:
+            break
+        t0 = time.perf_counter()
+        db.save_email_logs_to_db(CONTAINER_ID, batch)
+        latencies.append(time.perf_counter() - t0)
+    return {"db_save": summarize(scale, time.perf_counter() - start, latencies)}
+
+
+def stage_reconcile(scale, workdir):
+    """90% of messages have a Postfix log outcome, the rest only a Maildir arrival."""
+    sys.path.insert(0, BACKEND_DIR)
+    import db
+    from jobs import INGEST_BATCH_SIZE
+
+    db.init_db()
+    now = time.time()
+    sent, log, arrivals = [], [], []
+    for i, to in enumerate(recipients(scale)):
+        queue_id = f"{0x100000 + i:X}"
+        timestamp = now - i * 0.001
+        sent.append({"to": to, "subject": "Static", "status": "success", "timestamp": timestamp,
+                     "queue_id": queue_id})
+        if i % 10:
+            if i % 7 == 0:
+                log.append({"timestamp": timestamp + 0.5, "queue_id": queue_id, "recipient": to, "status": "deferred"})
+            log.append({"timestamp": timestamp + 1.0, "queue_id": queue_id, "recipient": to,
+                        "status": "bounced" if i % 50 == 0 else "sent"})
+        else:
+            arrivals.append({"to": to, "subject": "Static", "status": "success", "timestamp": timestamp + 1.0,
+                             "queue_id": queue_id, "delivered_to": to})
+    for i in range(0, scale, INGEST_BATCH_SIZE):
+        db.save_email_logs_to_db(CONTAINER_ID, sent[i:i + INGEST_BATCH_SIZE])
+    for i in range(0, len(log), INGEST_BATCH_SIZE):
+        db.save_postfix_log(CONTAINER_ID, log[i:i + INGEST_BATCH_SIZE])
+    for i in range(0, len(arrivals), INGEST_BATCH_SIZE):
+        db.save_email_logs_to_db(CONTAINER_ID, arrivals[i:i + INGEST_BATCH_SIZE], source="maildir")
+
+    results = {}
+    for name in ("reconcile", "reconcile_rerun"):
+        start = time.perf_counter()
+        db.reconcile_deliveries(CONTAINER_ID)
+        results[name] = summarize(scale, time.perf_counter() - start)
+    start = time.perf_counter()
+    db.delivery_summary(CONTAINER_ID)
+    results["delivery_summary"] = summarize(scale, time.perf_counter() - start)
+    return results
+
+
+def _timed_requests(get, calls):
+    latencies = []
+    start = time.perf_counter()
+    for args in calls:
+        t0 = time.perf_counter()
+        response = get(*args)
+        latencies.append(time.perf_counter() - t0)
+        assert response.status_code in (200, 304), response.status_code
+    return time.perf_counter() - start, latencies
+
+
+def stage_routes(scale, workdir):
+    sys.path.insert(0, BACKEND_DIR)
+    import flask_v1
+    from db import save_email_logs_to_db, save_template
+
+    app = flask_v1.create_app()
+    _seed_templates(save_template)
+    records = _records(scale)
+    while True:
+        batch = list(itertools.islice(records, 1000))
+        if not batch:
+            break
+        save_email_logs_to_db(CONTAINER_ID, batch)
+
+    client = app.test_client()
+    results = {}
+
+    latencies, rows, cursor = [], 0, None
+    start = time.perf_counter()
+    while True:
+        query = {"limit": 100, **({"cursor": cursor} if cursor else {})}
+        t0 = time.perf_counter()
+        page = client.get(f"/containers/emails/{CONTAINER_ID}", query_string=query).get_json()
+        latencies.append(time.perf_counter() - t0)
+        rows += len(page["items"])
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    results["emails_pages"] = summarize(rows, time.perf_counter() - start, latencies)
+
+    start = time.perf_counter()
+    exported = client.get(f"/containers/emails/{CONTAINER_ID}", query_string={"format": "stream"}).get_json()
+    results["emails_stream"] = summarize(len(exported), time.perf_counter() - start)
+
+    get = lambda url, headers=None: client.get(url, headers=headers)  # noqa: E731
+    for name, url in (("mails", "/mails"), ("mails_lite", "/mails?lite=1")):
+        seconds, latencies = _timed_requests(get, [(url,)] * MAILS_REQUESTS)
+        results[name] = summarize(MAILS_REQUESTS, seconds, latencies)
+    etag = client.get("/mails?lite=1").headers["ETag"]
+    seconds, latencies = _timed_requests(get, [("/mails?lite=1", {"If-None-Match": etag})] * MAILS_REQUESTS)
+    results["mails_304"] = summarize(MAILS_REQUESTS, seconds, latencies)
+    return results
+
+
+def run_stage(name, scale, workdir):
+    results = globals()[f"stage_{name}"](scale, workdir)
+    # ru_maxrss is in KiB on Linux
+    peak_rss_mb = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    for result in results.values():
+        result["peak_rss_mb"] = peak_rss_mb
+    return results
+
+
+# --- driver ----------------------------------------------------------------
+
+def revision():
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                             capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_DIR,
+                               capture_output=True, text=True).stdout.strip()
+        return rev + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def spawn_stage(name, scale):
+    """Run one stage in a fresh interpreter so its peak RSS and imports are its own."""
+    with tempfile.TemporaryDirectory(prefix=f"bench-{name}-") as workdir:
+        env = dict(os.environ, EMAIL_LOGS_DB=os.path.join(workdir, "email_logs.db"), GENERATION_BACKEND="stub")
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--stage", name, "--scale", str(scale), "--workdir", workdir],
+            env=env, capture_output=True, text=True,
+        )
+    for line in proc.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    raise RuntimeError(f"stage {name} failed (exit {proc.returncode}):\n{proc.stderr.strip()}")
+
+
+def compare(results, baseline, tolerance):
+    """Print throughput ratios against a baseline run; return the regressed result names."""
+    regressions = []
+    print(f"\nvs {baseline.get('revision')} (scale {baseline.get('scale')}):")
+    for name, result in results["results"].items():
+        old = baseline.get("results", {}).get(name)
+        if not old or not old.get("msgs_per_sec") or not result.get("msgs_per_sec"):
+            continue
+        ratio = result["msgs_per_sec"] / old["msgs_per_sec"]
+        flag = "  REGRESSION" if ratio < 1 - tolerance else ""
+        print(f"  {name:<14} {ratio:6.2f}x  ({old['msgs_per_sec']} -> {result['msgs_per_sec']} msg/s){flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", default="1k", help="messages per stage: 1000, 10k, 1M ... (default 1k)")
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"comma-separated subset of {','.join(STAGES)}")
+    parser.add_argument("--output", help="write results JSON here (default: stdout)")
+    parser.add_argument("--compare", help="baseline results JSON to compare throughput against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed throughput drop before failing")
+    parser.add_argument("--stage", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    scale = parse_scale(args.scale)
+
+    if args.stage:
+        sys.path.insert(0, BENCH_DIR)
+        print(RESULT_PREFIX + json.dumps(run_stage(args.stage, scale, args.workdir)), flush=True)
+        return
+
+    results = {
+        "revision": revision(),
+        "scale": scale,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "timestamp": time.time(),
+        "results": {},
+        "errors": {},
+    }
+    for name in args.stages.split(","):
+        name = name.strip()
+        try:
+            stage_results = spawn_stage(name, scale)
+        except RuntimeError as e:
+            results["errors"][name] = str(e)
+            print(f"{name}: failed", file=sys.stderr)
+            continue
+        results["results"].update(stage_results)
+        for result_name, result in stage_results.items():
+            print(f"{result_name:<14} {result['msgs_per_sec'] or 0:>12,.0f} msg/s  p50 {result['p50_ms']} ms  "
+                  f"p99 {result['p99_ms']} ms  peak RSS {result['peak_rss_mb']} MB", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    regressions = []
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        with contextlib.redirect_stdout(sys.stderr):
+            regressions = compare(results, baseline, args.tolerance)
+    if results["errors"] or regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
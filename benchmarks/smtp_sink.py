@@ -0,0 +1,95 @@
+"""In-process SMTP sink for benchmarks: accepts every message and throws it away.
+
+Speaks enough ESMTP (EHLO with PIPELINING, MAIL, RCPT, DATA, RSET, NOOP, QUIT)
+for smtplib and send_emails.send_envelope. DATA is answered like Postfix,
+``250 2.0.0 Ok: queued as <id>``, and each accepted recipient's arrival time
+is kept for latency measurements.
+"""
+import itertools
+import socketserver
+import threading
+import time
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    disable_nagle_algorithm = True
+
+    def reply(self, line):
+        self.wfile.write(line.encode("ascii") + b"\r\n")
+
+    def handle(self):
+        sink = self.server.sink
+        self.reply("220 sink ESMTP")
+        recipients = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line[:4].upper()
+            if command in (b"EHLO", b"HELO"):
+                self.wfile.write(b"250-sink\r\n250-PIPELINING\r\n250-8BITMIME\r\n250 SIZE 104857600\r\n")
+            elif command == b"MAIL":
+                recipients = []
+                self.reply("250 2.1.0 Ok")
+            elif command == b"RCPT":
+                recipients.append(line.split(b":", 1)[1].strip().strip(b"<>").decode("ascii", "replace"))
+                self.reply("250 2.1.5 Ok")
+            elif command == b"DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                size = 0
+                for data_line in iter(self.rfile.readline, b""):
+                    if data_line in (b".\r\n", b".\n"):
+                        break
+                    size += len(data_line)
+                self.reply(f"250 2.0.0 Ok: queued as {sink.accept(recipients, size)}")
+                recipients = []
+            elif command == b"RSET":
+                recipients = []
+                self.reply("250 2.0.0 Ok")
+            elif command == b"NOOP":
+                self.reply("250 2.0.0 Ok")
+            elif command == b"QUIT":
+                self.reply("221 2.0.0 Bye")
+                return
+            else:
+                self.reply("502 5.5.2 Error: command not recognized")
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class SMTPSink:
+    def __init__(self, host="127.0.0.1", port=0):
+        self._server = _Server((host, port), _SMTPHandler)
+        self._server.sink = self
+        self.host, self.port = self._server.server_address
+        self._ids = itertools.count(0x10000)
+        self._lock = threading.Lock()
+        self.messages = 0
+        self.bytes = 0
+        self.arrivals = {}  # recipient -> time.time() of its last accepted message
+
+    def accept(self, recipients, size):
+        now = time.time()
+        with self._lock:
+            self.messages += 1
+            self.bytes += size
+            for recipient in recipients:
+                self.arrivals[recipient] = now
+            return f"{next(self._ids):X}"
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -1,20 +1,72 @@
 import traceback
+import argparse
 import os
+import sys
 import subprocess
+import shutil
+import pwd
 import random
 import string
 import time
 import json
-from email.mime.text import MIMEText
+import gzip
+import hashlib
+import re
+import binascii
+import functools
+import bisect
+import threading
+import queue
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from email.header import Header
 import smtplib
 import requests
 
-LOG_FILE_PATH = "/var/log/email_records.json"
+LOG_FILE_PATH = "/var/log/email_records.jsonl"
+LEGACY_LOG_FILE_PATH = "/var/log/email_records.json"
+LOG_FSYNC_EVERY = 100          # records between fsyncs
+LOG_FSYNC_INTERVAL = 1.0       # max seconds between fsyncs
+LOG_ROTATE_BYTES = 16 * 1024 * 1024
+LOG_KEEP_SEGMENTS = 5
 BASE_EMAIL = "base@localhost"
 SMTP_HOST = "localhost"
 SMTP_PORT = 25
-USER_COUNT = 50
+SMTP_TIMEOUT = 30
+SMTP_POOL_SIZE = int(os.environ.get("SMTP_POOL_SIZE", 4))
+SMTP_MAX_IN_FLIGHT = int(os.environ.get("SMTP_MAX_IN_FLIGHT", 32))
+SMTP_MAX_MESSAGES_PER_CONNECTION = int(os.environ.get("SMTP_MAX_MESSAGES_PER_CONNECTION", 100))
+SMTP_BATCH_SIZE = int(os.environ.get("SMTP_BATCH_SIZE", 50))  # RCPT TOs per DATA; 1 disables batching
+QUEUE_ID_RE = re.compile(rb"queued as ([0-9A-Za-z]+)")
+SEND_RATE = float(os.environ.get("SEND_RATE", 100))  # messages/sec across the campaign; 0 = unlimited
+SEND_RATE_PER_DOMAIN = float(os.environ.get("SEND_RATE_PER_DOMAIN", 0))  # 0 = unlimited
+SEND_RATE_MIN = 1.0  # adaptive slowdown never goes below this
+RETRY_QUEUE_PATH = "/var/log/email_retry_queue.jsonl"
+RETRY_MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = 30  # seconds, doubled per attempt
+RETRY_MAX_DELAY = 3600
+USER_COUNT = int(os.environ.get("USER_COUNT", 50))
+RECIPIENTS_FILE = os.environ.get("RECIPIENTS_FILE")  # one address per line; overrides user1..USER_COUNT
+PASSWD_PATH = "/etc/passwd"
+PROVISION_MARKER_PATH = "/var/lib/send_emails/provisioned_users.json"
+PROVISION_BATCH_SIZE = 1000  # accounts per newusers run
+PROVISION_WORKERS = 8
+EMIT_RECORDS = os.environ.get("EMIT_RECORDS") == "1"  # set by the backend's campaign jobs
+RECORD_PREFIX = "@@record "
+EMIT_METRICS = os.environ.get("EMIT_METRICS") == "1"  # set by the backend when its /metrics is enabled
+METRICS_PREFIX = "@@metrics "
+METRICS_REPORT_INTERVAL = 5.0  # seconds between cumulative snapshots
+METRIC_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # = backend LATENCY_BUCKETS
 FLASK_API = "http://43.230.201.125:60025"
+TEMPLATE_CACHE_PATH = "/var/cache/email_templates.json"
+TEMPLATE_FETCH_TIMEOUT = 10
+QUOTE_SOURCE_URL = "https://zenquotes.io/api/quotes"  # returns a batch of quotes per call
+QUOTE_CACHE_PATH = "/var/cache/email_quotes.json"
+QUOTE_POOL_SIZE = 200
+QUOTE_REFILL_INTERVAL = 300  # seconds between background refreshes
+QUOTE_BREAKER_THRESHOLD = 3  # consecutive errors before the source is skipped
+QUOTE_BREAKER_COOLDOWN = 600  # seconds before a tripped source is tried again
 LOCAL_SPANISH_QUOTES = [
     "La vida es un sueño, y los sueños, sueños son. — Calderón de la Barca",
     "El secreto de la felicidad no está en hacer siempre lo que se quiere, sino en querer siempre lo que se hace. — Tolstoi",
@@ -24,30 +76,159 @@ LOCAL_SPANISH_QUOTES = [
     "No hay camino para la paz, la paz es el camino. — Mahatma Gandhi",
     "El sabio puede cambiar de opinión. El necio, nunca. — Kant"
 ]
+def _load_template_cache(path=TEMPLATE_CACHE_PATH):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+        return cached["etag"], cached["templates"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None, None
+
+
+def _save_template_cache(etag, templates, path=TEMPLATE_CACHE_PATH):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"etag": etag, "templates": templates}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError:
+        traceback.print_exc()
+
+
 def get_templates():
+    """Fetch the sender's view of the templates, revalidating the on-disk copy by ETag.
+
+    Unchanged templates cost one empty 304; if the backend is unreachable the
+    cached templates are used as they are.
+    """
+    etag, cached = _load_template_cache()
+    headers = {"If-None-Match": etag} if etag and cached is not None else {}
     try:
-        response = requests.get(f"{FLASK_API}/mails")
+        response = requests.get(f"{FLASK_API}/mails", params={"lite": 1}, headers=headers,
+                                timeout=TEMPLATE_FETCH_TIMEOUT)
+        if response.status_code == 304:
+            print(f"✅ Templates unchanged, using {len(cached)} cached templates.")
+            return cached
         response.raise_for_status()
         templates = response.json()
+        if response.headers.get("ETag"):
+            _save_template_cache(response.headers["ETag"], templates)
         print(f"✅ Retrieved {len(templates)} templates from backend.")
         return templates
     except Exception as e:
+        if cached is not None:
+            print(f"⚠️ Failed to fetch templates ({e}), using {len(cached)} cached templates.")
+            return cached
         print(f"❌ Failed to fetch templates: {e}")
         return []
 
+class CircuitBreaker:
+    """Stops calling a failing source after ``threshold`` consecutive errors.
+
+    Once ``cooldown`` seconds have passed a single trial call is let through;
+    success closes the breaker again, failure re-opens it.
+    """
+
+    def __init__(self, threshold=QUOTE_BREAKER_THRESHOLD, cooldown=QUOTE_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+
+    def allow(self):
+        if self.opened_at is None:
+            return True
+        return time.monotonic() - self.opened_at >= self.cooldown
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+
+
+class QuoteProvider:
+    """Bounded in-memory pool of quotes, refilled by a background thread.
+
+    ``get()`` never touches the network: it picks from the pool, which is seeded
+    from the on-disk cache (or LOCAL_SPANISH_QUOTES) and topped up in the
+    background from QUOTE_SOURCE_URL behind a circuit breaker.
+    """
+
+    def __init__(self, url=QUOTE_SOURCE_URL, cache_path=QUOTE_CACHE_PATH,
+                 size=QUOTE_POOL_SIZE, refill_interval=QUOTE_REFILL_INTERVAL):
+        self.url = url
+        self.cache_path = cache_path
+        self.refill_interval = refill_interval
+        self.breaker = CircuitBreaker()
+        self._pool = deque(self._load_cache(), maxlen=size)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def get(self):
+        self._ensure_refiller()
+        with self._lock:
+            if self._pool:
+                return random.choice(self._pool)
+        return random.choice(LOCAL_SPANISH_QUOTES)
+
+    def _ensure_refiller(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._refill_loop, daemon=True)
+                    self._thread.start()
+
+    def _refill_loop(self):
+        while True:
+            if self.breaker.allow():
+                self.refill()
+            time.sleep(self.refill_interval)
+
+    def refill(self):
+        """Fetch one batch of quotes into the pool; returns how many were added."""
+        try:
+            res = requests.get(self.url, timeout=5)
+            res.raise_for_status()
+            quotes = [f"{item['q']} — {item['a']}" for item in res.json()]
+        except Exception:
+            self.breaker.record_failure()
+            return 0
+        self.breaker.record_success()
+        with self._lock:
+            self._pool.extend(quotes)
+            snapshot = list(self._pool)
+        self._save_cache(snapshot)
+        return len(quotes)
+
+    def _load_cache(self):
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return []
+
+    def _save_cache(self, quotes):
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            tmp_path = self.cache_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(quotes, f, ensure_ascii=False)
+            os.replace(tmp_path, self.cache_path)
+        except OSError:
+            traceback.print_exc()
+
+
+quote_provider = QuoteProvider()
+
+
 def fetch_spanish_quote():
-    """Try to fetch a Spanish quote from the web, fallback to local list if it fails."""
-    try:
-        res = requests.get("https://zenquotes.io/api/random", timeout=5)
-        if res.status_code == 200:
-            data = res.json()
-            quote = data[0]['q']
-            author = data[0]['a']
-            return f"{quote} — {author}"
-    except Exception:
-        pass
-    # fallback: random local quote
-    return random.choice(LOCAL_SPANISH_QUOTES)
+    """Return a quote from the prefetched pool, falling back to the local list. Never blocks."""
+    return quote_provider.get()
 
 def generate_message_body(recipient):
     """Create a meaningful Spanish message body."""
@@ -56,38 +237,348 @@ def generate_message_body(recipient):
     random_data = random_string(16)
     outro = f"\n\nEste es un mensaje automático de prueba.\nIdentificador: {random_data}\n¡Ten un buen día!"
     return intro + quote + outro
-def ensure_users():
-    """Create users user1 to user50 inside the container if they don't exist."""
-    for i in range(1, USER_COUNT + 1):
-        username = f"user{i}"
-        try:
-            subprocess.run(['id', username], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        except subprocess.CalledProcessError:
-            subprocess.run(['useradd', '-m', username], check=True)
-            maildir = f"/home/{username}/Maildir"
-            for d in ['cur', 'new', 'tmp']:
-                os.makedirs(os.path.join(maildir, d), exist_ok=True)
-            print(f"Created user {username}")
+def load_recipients(recipients_file=RECIPIENTS_FILE, user_count=USER_COUNT):
+    """Recipients from ``recipients_file`` if set, else user1..user_count at localhost."""
+    if recipients_file:
+        with open(recipients_file, "r", encoding="utf-8") as f:
+            return [line.strip() for line in f if line.strip()]
+    return [f"user{i}@localhost" for i in range(1, user_count + 1)]
+
+
+def local_usernames(recipients):
+    """Mailbox names this container must host for the given recipients."""
+    return [r.split("@")[0] for r in recipients if r.split("@")[-1] in ("localhost", "localhost.localdomain")]
+
+
+def _passwd_users(path=PASSWD_PATH):
+    """Usernames in the passwd file, read in one pass."""
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        return {line.split(":", 1)[0] for line in f if line.strip() and not line.startswith("#")}
+
+
+def _passwd_stamp(path=PASSWD_PATH):
+    st = os.stat(path)
+    return [st.st_mtime_ns, st.st_size]
+
+
+def _load_provision_marker(path=PROVISION_MARKER_PATH):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            marker = json.load(f)
+        return marker["passwd"], set(marker["users"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None, set()
+
+
+def _save_provision_marker(users, path=PROVISION_MARKER_PATH):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"passwd": _passwd_stamp(), "users": sorted(users)}, f)
+        os.replace(tmp_path, path)
+    except OSError:
+        traceback.print_exc()
+
+
+def _create_users(usernames):
+    """Create accounts with home directories through ``newusers``, else one useradd each."""
+    if shutil.which("newusers"):
+        # name:password:uid:gid:gecos:home:shell; empty uid/gid get fresh ids and a same-named group
+        lines = "".join(f"{u}:{random_string()}:::{u}:/home/{u}:/bin/sh\n" for u in usernames)
+        subprocess.run(["newusers"], input=lines, text=True, check=True)
+    else:
+        for username in usernames:
+            subprocess.run(["useradd", "-m", username], check=True)
+
+
+def _create_maildir(username):
+    entry = pwd.getpwnam(username)
+    maildir = os.path.join(entry.pw_dir, "Maildir")
+    for d in ("", "cur", "new", "tmp"):
+        path = os.path.join(maildir, d)
+        os.makedirs(path, exist_ok=True)
+        os.chown(path, entry.pw_uid, entry.pw_gid)
+
+
+def ensure_users(usernames=None):
+    """Create the given users (default user1..USER_COUNT) inside the container if they don't exist.
+
+    /etc/passwd is read once to find the missing accounts, which are created in
+    bulk with their Maildirs. A marker records the provisioned set together with
+    the passwd file's mtime and size, so a repeat run with the same users and an
+    untouched passwd file does no work at all.
+    """
+    if usernames is None:
+        usernames = [f"user{i}" for i in range(1, USER_COUNT + 1)]
+    wanted = set(usernames)
+    stamp, provisioned = _load_provision_marker()
+    if stamp == _passwd_stamp() and wanted <= provisioned:
+        return
+
+    existing = _passwd_users()
+    missing = sorted(wanted - existing)
+    if missing:
+        for batch in chunked(missing, PROVISION_BATCH_SIZE):
+            _create_users(batch)
+        with ThreadPoolExecutor(max_workers=PROVISION_WORKERS) as executor:
+            list(executor.map(_create_maildir, missing))
+        print(f"Created {len(missing)} users")
+    _save_provision_marker((provisioned & existing) | wanted)
 
 def random_string(n=32):
     """Generate a random string for email body."""
     return ''.join(random.choices(string.ascii_letters + string.digits, k=n))
 
-def load_email_logs():
-    """Load existing email logs from file or return empty list."""
-    if os.path.exists(LOG_FILE_PATH):
+class EmailLog:
+    """Append-only JSON-Lines send log with batched fsync and size-based rotation.
+
+    Each record is one line, so appending is O(1) regardless of history size.
+    When the active file grows past ``rotate_bytes`` it is gzip-compacted into
+    ``<path>.1.gz`` (older segments shift up) and only ``keep_segments`` are kept.
+    """
+
+    def __init__(self, path=LOG_FILE_PATH, fsync_every=LOG_FSYNC_EVERY,
+                 fsync_interval=LOG_FSYNC_INTERVAL, rotate_bytes=LOG_ROTATE_BYTES,
+                 keep_segments=LOG_KEEP_SEGMENTS):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.rotate_bytes = rotate_bytes
+        self.keep_segments = keep_segments
+        self._lock = threading.Lock()
+        self._file = open(path, "ab")
+        self._size = self._file.tell()
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def append(self, record):
+        with sender_metrics.time("log_write_seconds"):
+            self._append(record)
+
+    def _append(self, record):
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            self._file.write(line)
+            self._size += len(line)
+            self._pending += 1
+            if (self._pending >= self.fsync_every
+                    or time.monotonic() - self._last_sync >= self.fsync_interval):
+                self._sync()
+            if self._size >= self.rotate_bytes:
+                self._rotate()
+
+    def flush(self):
+        with self._lock:
+            self._sync()
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._sync()
+                self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _sync(self):
+        self._file.flush()
+        if self._pending:
+            os.fsync(self._file.fileno())
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def _rotate(self):
+        self._sync()
+        self._file.close()
+        oldest = f"{self.path}.{self.keep_segments}.gz"
+        if os.path.exists(oldest):
+            os.remove(oldest)
+        for n in range(self.keep_segments - 1, 0, -1):
+            src = f"{self.path}.{n}.gz"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{n + 1}.gz")
+        with open(self.path, "rb") as src, gzip.open(f"{self.path}.1.gz", "wb") as dst:
+            while True:
+                chunk = src.read(1024 * 1024)
+                if not chunk:
+                    break
+                dst.write(chunk)
+        self._file = open(self.path, "wb")
+        self._size = 0
+
+
+def _iter_jsonl(f):
+    for line in f:
         try:
-            with open(LOG_FILE_PATH, 'r') as f:
-                return json.load(f)
+            yield json.loads(line)
+        except ValueError:
+            # torn last line from a crash mid-write
+            continue
+
+
+def iter_email_logs(path=LOG_FILE_PATH, keep_segments=LOG_KEEP_SEGMENTS):
+    """Stream email log records oldest first without loading history into memory."""
+    if os.path.exists(LEGACY_LOG_FILE_PATH):
+        try:
+            with open(LEGACY_LOG_FILE_PATH, "r") as f:
+                yield from json.load(f)
         except Exception:
             traceback.print_exc()
-            return []
-    return []
+    for n in range(keep_segments, 0, -1):
+        segment = f"{path}.{n}.gz"
+        if os.path.exists(segment):
+            with gzip.open(segment, "rb") as f:
+                yield from _iter_jsonl(f)
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            yield from _iter_jsonl(f)
+
+def send_envelope(smtp, from_addr, to_addrs, pipelining=True):
+    """MAIL FROM and RCPT TO for every recipient, pipelined (RFC 2920) if the server allows it.
+
+    Returns the dict of refused recipients; raises SMTPSenderRefused, or
+    SMTPRecipientsRefused when nobody was accepted, exactly like sendmail.
+    """
+    if not pipelining:
+        code, resp = smtp.mail(from_addr)
+        if code != 250:
+            smtp.rset()
+            raise smtplib.SMTPSenderRefused(code, resp, from_addr)
+        replies = [smtp.rcpt(r) for r in to_addrs]
+    else:
+        commands = [f"MAIL FROM:{smtplib.quoteaddr(from_addr)}"]
+        commands += [f"RCPT TO:{smtplib.quoteaddr(r)}" for r in to_addrs]
+        smtp.send("".join(c + "\r\n" for c in commands))
+        code, resp = smtp.getreply()
+        # Every pipelined command gets a reply; drain them all to keep the session in sync
+        replies = [smtp.getreply() for _ in to_addrs]
+        if code != 250:
+            smtp.rset()
+            raise smtplib.SMTPSenderRefused(code, resp, from_addr)
+    refused = {r: reply for r, reply in zip(to_addrs, replies) if reply[0] not in (250, 251)}
+    if len(refused) == len(to_addrs):
+        smtp.rset()
+        raise smtplib.SMTPRecipientsRefused(refused)
+    return refused
+
+
+def send_data(smtp, msg):
+    """DATA for an accepted envelope; returns the server's reply text."""
+    code, resp = smtp.data(msg)
+    if code != 250:
+        smtp.rset()
+        raise smtplib.SMTPDataError(code, resp)
+    return resp
+
+
+def parse_queue_id(reply):
+    """Postfix queue id from a DATA reply ("250 2.0.0 Ok: queued as 4YbC2x0Kz9z1"), or None."""
+    match = QUEUE_ID_RE.search(reply or b"")
+    return match.group(1).decode("ascii") if match else None
+
+
+class SMTPOutcomeUnknown(smtplib.SMTPException):
+    """The session dropped after DATA went out; the server may or may not have queued the message."""
+
+
+class PooledConnection:
+    """An SMTP session checked out of a SMTPConnectionPool."""
+
+    def __init__(self, smtp):
+        self.smtp = smtp
+        self.sent = 0
+        self.broken = False
+
+
+class SMTPConnectionPool:
+    """Bounded pool of reusable SMTP connections shared by sender threads.
+
+    At most ``size`` sessions are open at once. A session is retired after
+    ``max_messages`` messages (so the server can recycle its smtpd process) and
+    dropped sessions are replaced transparently by ``sendmail``.
+    """
+
+    def __init__(self, host=SMTP_HOST, port=SMTP_PORT, size=SMTP_POOL_SIZE,
+                 max_messages=SMTP_MAX_MESSAGES_PER_CONNECTION, timeout=SMTP_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.max_messages = max_messages
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self):
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        smtp.ehlo_or_helo_if_needed()
+        return PooledConnection(smtp)
+
+    @staticmethod
+    def _discard(conn):
+        try:
+            conn.smtp.quit()
+        except Exception:
+            conn.smtp.close()
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection, opening one if none are idle."""
+        self._slots.acquire()
+        conn = None
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+            yield conn
+        except smtplib.SMTPServerDisconnected:
+            if conn is not None:
+                conn.broken = True
+            raise
+        finally:
+            if conn is not None:
+                if conn.broken or conn.sent >= self.max_messages:
+                    self._discard(conn)
+                else:
+                    self._idle.put(conn)
+            self._slots.release()
+
+    def sendmail(self, from_addr, to_addrs, msg):
+        """Send one message to one or more recipients.
+
+        A session the server dropped while idle is replaced once, transparently.
+        Once DATA has gone out the server may already have queued the message,
+        so a disconnect from then on raises SMTPOutcomeUnknown: the message must
+        not be sent again, and its outcome is left to delivery reconciliation.
+
+        Returns ``(refused, queue_id)``; the queue id is None when the server
+        didn't report one.
+        """
+        for attempt in range(2):
+            data_sent = False
+            try:
+                with self.connection() as conn:
+                    refused = send_envelope(conn.smtp, from_addr, to_addrs, conn.smtp.has_extn("pipelining"))
+                    data_sent = True
+                    reply = send_data(conn.smtp, msg)
+                    conn.sent += 1
+                    return refused, parse_queue_id(reply)
+            except smtplib.SMTPServerDisconnected as e:
+                if data_sent:
+                    raise SMTPOutcomeUnknown(f"connection lost after DATA: {e}") from e
+                if attempt:
+                    raise
+
+    def close(self):
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                break
 
-def save_email_logs(logs):
-    """Save email logs to file."""
-    with open(LOG_FILE_PATH, 'w') as f:
-        json.dump(logs, f)
 
 # def send_emails():
 #     logs = load_email_logs()
@@ -149,66 +640,543 @@ def distribute_users_among_templates(users, templates):
     return groups
 
 
-def send_emails():
-    logs = load_email_logs()
-    smtp = smtplib.SMTP(SMTP_HOST, SMTP_PORT)
-    sent_count, failed_count = 0, 0
+def chunked(items, size):
+    """Split a list into consecutive slices of at most ``size`` items."""
+    size = max(1, size)
+    return [items[i:i + size] for i in range(0, len(items), size)]
 
-    # 1️⃣ Fetch templates from Flask backend
-    templates = get_templates()
-    if not templates:
-        print("⚠️ No templates found. Using fallback messages with quotes.")
-        templates = [{"name": "Default", "html": None}]
 
-    users = [f"user{i}@localhost" for i in range(1, USER_COUNT + 1)]
-    mail_groups = distribute_users_among_templates(users, templates)
+PLACEHOLDER_RE = re.compile(r"\{\{\s*(\w+)\s*\}\}")
+
+
+def _qp_chunk(text):
+    """Quoted-printable encode a chunk, ending it with a soft line break.
+
+    Because every chunk ends with ``=\r\n``, independently encoded chunks can
+    be concatenated into one valid quoted-printable body.
+    """
+    if not text:
+        return b""
+    encoded = binascii.b2a_qp(text.replace("\r\n", "\n").encode("utf-8"))
+    return encoded.replace(b"\n", b"\r\n") + b"=\r\n"
+
+
+def _encode_header(value):
+    if value.isascii():
+        return value
+    return Header(value, "utf-8").encode()
+
+
+class CompiledTemplate:
+    """An HTML template parsed once into static chunks and ``{{name}}`` slots.
+
+    Static chunks and the MIME headers are encoded at compile time; rendering a
+    recipient's message only encodes the substituted values and joins bytes.
+    Placeholders without a value are left in the body untouched.
+    """
+
+    def __init__(self, html, subject, from_addr=BASE_EMAIL):
+        self._static = []
+        self._slots = []
+        pos = 0
+        for match in PLACEHOLDER_RE.finditer(html):
+            self._static.append(html[pos:match.start()])
+            self._slots.append((match.group(1), match.group(0)))
+            pos = match.end()
+        self._static.append(html[pos:])
+        self.variables = frozenset(name for name, _ in self._slots)
+        self._static_qp = [_qp_chunk(chunk) for chunk in self._static]
+        self._head = (
+            'Content-Type: text/html; charset="utf-8"\r\n'
+            "MIME-Version: 1.0\r\n"
+            "Content-Transfer-Encoding: quoted-printable\r\n"
+            f"Subject: {_encode_header(subject)}\r\n"
+            f"From: {from_addr}\r\n"
+            "To: "
+        ).encode("utf-8")
+
+    def _value(self, slot, values):
+        name, raw = slot
+        return str(values[name]) if name in values else raw
+
+    def render(self, to_header, values):
+        """Return the complete RFC 5322 message as CRLF-terminated bytes."""
+        out = [self._head, _encode_header(to_header).encode("ascii"), b"\r\n\r\n"]
+        for static_qp, slot in zip(self._static_qp, self._slots):
+            out.append(static_qp)
+            out.append(_qp_chunk(self._value(slot, values)))
+        out.append(self._static_qp[-1])
+        return b"".join(out)
+
+    def render_text(self, values, limit=None):
+        """Return the substituted body as text, stopping once ``limit`` chars are built."""
+        out, size = [], 0
+        for static, slot in zip(self._static, self._slots):
+            for piece in (static, self._value(slot, values)):
+                out.append(piece)
+                size += len(piece)
+            if limit is not None and size >= limit:
+                return "".join(out)[:limit]
+        out.append(self._static[-1])
+        text = "".join(out)
+        return text if limit is None else text[:limit]
+
+
+@functools.lru_cache(maxsize=64)
+def compile_template(html, subject):
+    return CompiledTemplate(html, subject)
+
+
+def template_variables(recipient):
+    """Per-recipient values available to templates as {{user}}, {{email}} and {{domain}}."""
+    user, _, domain = recipient.partition("@")
+    return {"user": user, "email": recipient, "domain": domain}
+
+
+def template_version(tpl):
+    """Identify the exact template HTML a record was rendered from.
+
+    ``template_updated_at`` is compared with the backend's current template;
+    ``template_hash`` (the backend's body hash of the HTML) finds an older
+    version the backend has already stored.
+    """
+    return {
+        "template_updated_at": tpl.get("updated_at"),
+        "template_hash": hashlib.sha256(tpl["html"].encode("utf-8")).hexdigest(),
+    }
+
+
+def make_record(recipient, subject, body_snippet, template_id=None, template_vars=None, version=None):
+    record = {
+        "to": recipient,
+        "subject": subject,
+        "body_snippet": body_snippet,
+        "timestamp": time.time(),
+        "status": "pending"
+    }
+    if template_id is not None:
+        # Lets the backend store the body as template + variables instead of a copy
+        record["template_id"] = template_id
+        record["template_vars"] = template_vars or {}
+        record.update(version or {})
+    return record
+
+
+def iter_outgoing(mail_groups, batch_size=SMTP_BATCH_SIZE):
+    """Yield (recipients, subject, message, records) transactions for every group.
 
+    Templates without placeholders render the same body for everyone, so their
+    recipients are batched into one DATA with up to ``batch_size`` RCPT TOs.
+    Personalised bodies go one recipient per message.
+
+    Template records carry the template version; the first record of each
+    group also carries the HTML itself, so the backend can store the body even
+    when the template was edited since (or came from the offline cache).
+    """
     for group in mail_groups:
         tpl = group["template"]
         tpl_name = tpl.get("name", "Untitled")
         tpl_html = tpl.get("html")
+        # Fallback template: the whole body is the generated quote message
+        compiled = compile_template(tpl_html or "{{body}}", tpl_name)
+        version = template_version(tpl) if tpl_html else None
+        first = {"template_html": tpl_html} if tpl.get("id") is not None else {}
+
+        if tpl_html and not compiled.variables and batch_size > 1:
+            with sender_metrics.time("render_seconds"):
+                snippet = compiled.render_text({}, limit=200)
+                message = compiled.render("undisclosed-recipients:;", {})
+            for batch in chunked(group["recipients"], batch_size):
+                records = [make_record(r, tpl_name, snippet, tpl.get("id"), version=version) for r in batch]
+                records[0].update(first)
+                first = {}
+                yield batch, tpl_name, message, records
+            continue
 
         for recipient in group["recipients"]:
+            values = template_variables(recipient)
+            if not tpl_html:
+                values["body"] = generate_message_body(recipient)
+
+            with sender_metrics.time("render_seconds"):
+                message = compiled.render(recipient, values)
+                snippet = compiled.render_text(values, limit=200)
             if tpl_html:
-                # Use saved template HTML as email body
-                body_content = tpl_html.replace("{{user}}", recipient.split("@")[0])
+                used = {name: values[name] for name in compiled.variables if name in values}
+                record = make_record(recipient, tpl_name, snippet, tpl.get("id"), used, version)
+                record.update(first)
+                first = {}
             else:
-                # Fallback: generate quote-based message
-                body_content = generate_message_body(recipient)
+                record = make_record(recipient, tpl_name, snippet)
+            yield [recipient], tpl_name, message, [record]
 
-            msg = MIMEText(body_content, "html")
-            msg["Subject"] = tpl_name
-            msg["From"] = BASE_EMAIL
-            msg["To"] = recipient
 
-            record = {
-                "to": recipient,
-                "subject": tpl_name,
-                "body_snippet": body_content[:200],
-                "timestamp": time.time(),
-                "status": "pending"
+class TokenBucket:
+    """Thread-safe token bucket; ``rate`` tokens/sec refill up to ``burst``. rate <= 0 disables it."""
+
+    def __init__(self, rate, burst=None):
+        self.base_rate = rate
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, n=1):
+        """Block until ``n`` tokens are available, then take them."""
+        if self.base_rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                # Requests larger than the bucket may drive it negative instead of waiting forever
+                if self._tokens >= min(n, self.burst):
+                    self._tokens -= n
+                    return
+                wait = (min(n, self.burst) - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def slow_down(self):
+        """Multiplicative decrease after a temporary failure."""
+        if self.base_rate <= 0:
+            return
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = max(min(SEND_RATE_MIN, self.base_rate), self.rate / 2)
+
+    def recover(self):
+        """Additive increase back towards the configured rate after a success."""
+        if self.rate < self.base_rate:
+            with self._lock:
+                self._refill(time.monotonic())
+                self.rate = min(self.base_rate, self.rate + self.base_rate * 0.01)
+
+
+class SendScheduler:
+    """Paces transactions through a global and per-domain token buckets.
+
+    4xx responses halve the rate of the global bucket and the affected domain's
+    bucket; successes slowly restore it.
+    """
+
+    def __init__(self, rate=SEND_RATE, domain_rate=SEND_RATE_PER_DOMAIN):
+        self.domain_rate = domain_rate
+        self.global_bucket = TokenBucket(rate)
+        self._domains = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, domain):
+        with self._lock:
+            if domain not in self._domains:
+                self._domains[domain] = TokenBucket(self.domain_rate)
+            return self._domains[domain]
+
+    @staticmethod
+    def _domain_counts(recipients):
+        counts = {}
+        for recipient in recipients:
+            domain = recipient.rpartition("@")[2].lower()
+            counts[domain] = counts.get(domain, 0) + 1
+        return counts
+
+    def wait(self, recipients):
+        self.global_bucket.acquire(len(recipients))
+        for domain, n in self._domain_counts(recipients).items():
+            self._bucket(domain).acquire(n)
+
+    def record(self, recipients, temporary_failure):
+        buckets = [self.global_bucket] + [self._bucket(d) for d in self._domain_counts(recipients)]
+        for bucket in buckets:
+            if temporary_failure:
+                bucket.slow_down()
+            else:
+                bucket.recover()
+
+
+class RetryQueue:
+    """Deferred transactions persisted as JSON Lines so they survive between runs."""
+
+    def __init__(self, path=RETRY_QUEUE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def push(self, entry):
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def take_due(self, now=None):
+        """Remove and return the entries whose retry time has come; keep the rest queued."""
+        now = time.time() if now is None else now
+        if not os.path.exists(self.path):
+            return []
+        with self._lock:
+            with open(self.path, "rb") as f:
+                entries = list(_iter_jsonl(f))
+            due = [e for e in entries if e["next_attempt"] <= now]
+            waiting = [e for e in entries if e["next_attempt"] > now]
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for entry in waiting:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            os.replace(tmp_path, self.path)
+        return due
+
+
+_output_lock = threading.Lock()
+
+
+class SenderMetrics:
+    """Counters and latency histograms for this run, reported as ``@@metrics <json>`` lines.
+
+    Snapshots are cumulative; the backend turns them into deltas. When disabled
+    every method returns straight away.
+    """
+
+    def __init__(self, enabled=EMIT_METRICS, buckets=METRIC_BUCKETS, interval=METRICS_REPORT_INTERVAL):
+        self.enabled = enabled
+        self.buckets = buckets
+        self.interval = interval
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._last_report = time.monotonic()
+
+    def inc(self, name, amount=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def observe(self, name, seconds):
+        if not self.enabled:
+            return
+        i = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            hist = self._histograms.get(name)
+            if hist is None:
+                hist = self._histograms[name] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            hist["counts"][i] += 1
+            hist["sum"] += seconds
+            hist["count"] += 1
+
+    @contextmanager
+    def time(self, name):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "histograms": {name: {"buckets": list(self.buckets), "counts": list(h["counts"]),
+                                      "sum": h["sum"], "count": h["count"]}
+                               for name, h in self._histograms.items()},
             }
 
-            try:
-                smtp.sendmail(BASE_EMAIL, [recipient], msg.as_string())
+    def report(self, force=False):
+        """Write a snapshot line if forced or ``interval`` has passed since the last one."""
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._last_report < self.interval:
+                return
+            self._last_report = now
+        line = METRICS_PREFIX + json.dumps(self.snapshot()) + "\n"
+        with _output_lock:
+            sys.stdout.write(line)
+
+
+sender_metrics = SenderMetrics()
+
+
+def report(line, record=None):
+    """Print a progress line from any sender thread without interleaving.
+
+    With EMIT_RECORDS set, the record follows as one ``@@record <json>`` line so
+    the backend can ingest results while the campaign is still running.
+    """
+    text = line + "\n"
+    if record is not None and EMIT_RECORDS:
+        text += RECORD_PREFIX + json.dumps(record, ensure_ascii=False) + "\n"
+    with _output_lock:
+        sys.stdout.write(text)
+    sender_metrics.report()
+
+
+def retry_delay(attempts):
+    """Exponential backoff with jitter for the given number of previous attempts."""
+    delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempts)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def _describe(code, resp):
+    resp = resp.decode(errors="ignore") if isinstance(resp, bytes) else resp
+    return f"({code}, {resp!r})"
+
+
+def _is_temporary(error):
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    # Dropped or refused connections usually mean an overloaded server
+    return isinstance(error, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, OSError))
+
+
+class SendEngine:
+    """Delivers prepared transactions on a worker pool with pacing, retries and logging.
+
+    Each recipient ends up ``success``, ``failure: ...`` or, for 4xx answers and
+    dropped connections, ``deferred: ...`` with the transaction queued for a
+    later run until RETRY_MAX_ATTEMPTS is reached. A connection lost after DATA
+    leaves ``unknown: ...``, which is never retried since the server may
+    already have queued the message.
+    """
+
+    def __init__(self, pool, email_log, scheduler, retry_queue,
+                 workers=SMTP_POOL_SIZE, max_in_flight=SMTP_MAX_IN_FLIGHT):
+        self.pool = pool
+        self.email_log = email_log
+        self.scheduler = scheduler
+        self.retry_queue = retry_queue
+        self.counts = {"sent": 0, "failed": 0, "deferred": 0, "unknown": 0}
+        self._counts_lock = threading.Lock()
+        self._in_flight = threading.BoundedSemaphore(max_in_flight)
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+
+    def submit(self, recipients, tpl_name, message, records, attempts=0):
+        # Pacing and backpressure both block the producer, never the workers
+        self.scheduler.wait(recipients)
+        self._in_flight.acquire()
+        future = self._executor.submit(self._deliver, recipients, tpl_name, message, records, attempts)
+        future.add_done_callback(self._on_done)
+
+    def _on_done(self, future):
+        self._in_flight.release()
+        if future.exception():
+            traceback.print_exception(future.exception())
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        return self.counts
+
+    def _deliver(self, recipients, tpl_name, message, records, attempts):
+        try:
+            with sender_metrics.time("smtp_transaction_seconds"):
+                refused, queue_id = self.pool.sendmail(BASE_EMAIL, recipients, message)
+            error = None
+        except smtplib.SMTPRecipientsRefused as e:
+            refused, queue_id, error = e.recipients, None, None
+        except Exception as e:
+            refused, queue_id, error = {}, None, e
+
+        deferred = []
+        for recipient, record in zip(recipients, records):
+            if isinstance(error, SMTPOutcomeUnknown):
+                record["status"] = f"unknown: {error}"
+                self._count("unknown")
+                self.email_log.append(record)
+                report(f"❓ Outcome unknown for '{tpl_name}' to {recipient}: {error}", record)
+                continue
+            if error is not None:
+                temporary, reason = _is_temporary(error), str(error)
+            elif recipient in refused:
+                code, resp = refused[recipient]
+                temporary, reason = 400 <= code < 500, _describe(code, resp)
+            else:
                 record["status"] = "success"
-                sent_count += 1
-                print(f"✅ Sent '{tpl_name}' to {recipient}")
-            except Exception as e:
-                record["status"] = f"failure: {str(e)}"
-                failed_count += 1
-                print(f"❌ Failed to send '{tpl_name}' to {recipient}: {e}")
-
-            logs.append(record)
-            save_email_logs(logs)
-
-    smtp.quit()
-    print(f"\n📬 Email sending completed: {sent_count} succeeded, {failed_count} failed.")
+                record["queue_id"] = queue_id
+                self._count("sent")
+                self.email_log.append(record)
+                report(f"✅ Sent '{tpl_name}' to {recipient}", record)
+                continue
+
+            if temporary and attempts + 1 < RETRY_MAX_ATTEMPTS:
+                record["status"] = f"deferred: {reason}"
+                deferred.append((recipient, record))
+                self._count("deferred")
+                message_line = f"⏳ Deferred '{tpl_name}' to {recipient}: {reason}"
+            else:
+                record["status"] = f"failure: {reason}"
+                self._count("failed")
+                message_line = f"❌ Failed to send '{tpl_name}' to {recipient}: {reason}"
+            self.email_log.append(record)
+            report(message_line, record)
+
+        self.scheduler.record(recipients, temporary_failure=bool(deferred))
+        if deferred:
+            self.retry_queue.push({
+                "recipients": [r for r, _ in deferred],
+                "subject": tpl_name,
+                "message": message.decode("ascii") if isinstance(message, bytes) else message,
+                "records": [dict(rec, status="pending") for _, rec in deferred],
+                "attempts": attempts + 1,
+                "next_attempt": time.time() + retry_delay(attempts),
+            })
+
+    def _count(self, key):
+        with self._counts_lock:
+            self.counts[key] += 1
+        sender_metrics.inc(f"messages_{key}_total")
+
+
+def send_emails(users=None):
+    # Settings are read at call time so a harness can repoint them before a run
+    email_log = EmailLog(LOG_FILE_PATH)
+    pool = SMTPConnectionPool(SMTP_HOST, SMTP_PORT)
+    retry_queue = RetryQueue(RETRY_QUEUE_PATH)
+    engine = SendEngine(pool, email_log, SendScheduler(SEND_RATE, SEND_RATE_PER_DOMAIN), retry_queue)
+
+    # 0️⃣ Retry deferred messages from earlier runs whose backoff has expired
+    due = retry_queue.take_due()
+    if due:
+        print(f"🔁 Retrying {len(due)} deferred messages.")
+    for entry in due:
+        for record in entry["records"]:
+            record["timestamp"] = time.time()
+        engine.submit(entry["recipients"], entry["subject"], entry["message"],
+                      entry["records"], attempts=entry["attempts"])
+
+    # 1️⃣ Fetch templates from Flask backend
+    templates = get_templates()
+    if not templates:
+        print("⚠️ No templates found. Using fallback messages with quotes.")
+        templates = [{"name": "Default", "html": None}]
+
+    users = users if users is not None else load_recipients()
+    mail_groups = distribute_users_among_templates(users, templates)
+
+    for recipients, tpl_name, message, records in iter_outgoing(mail_groups):
+        engine.submit(recipients, tpl_name, message, records)
+
+    counts = engine.close()
+    pool.close()
+    email_log.close()
+    sender_metrics.report(force=True)
+    print(f"\n📬 Email sending completed: {counts['sent']} succeeded, {counts['failed']} failed, "
+          f"{counts['deferred']} deferred for retry, {counts['unknown']} with unknown outcome.")
     print(f"🗂️ Logs saved to {LOG_FILE_PATH}")
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Send a campaign from this container.")
+    parser.add_argument("--user-count", type=int, default=USER_COUNT,
+                        help="recipients user1..N@localhost (default: $USER_COUNT or 50)")
+    parser.add_argument("--recipients-file", default=RECIPIENTS_FILE,
+                        help="one address per line; overrides --user-count")
+    args = parser.parse_args()
+    recipients = load_recipients(args.recipients_file, args.user_count)
     print("Ensuring users exist...")
-    ensure_users()
+    ensure_users(local_usernames(recipients))
     print("Sending emails...")
-    send_emails()
+    send_emails(recipients)
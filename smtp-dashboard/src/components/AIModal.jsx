@@ -48,7 +48,16 @@ export default function AIModal({ onClose, onRun, initialPrompt = "" }) {
       });
 
       if (!res.ok) throw new Error("Network error");
-      const data = await res.json();
+      let data = await res.json();
+
+      // Generation is queued server-side; poll the ticket until it finishes
+      while (data.status === "pending") {
+        await new Promise((r) => setTimeout(r, 2000));
+        const poll = await fetch(`http://43.230.201.125:60025/generate/${data.ticket}`);
+        if (!poll.ok) throw new Error("Network error");
+        data = await poll.json();
+      }
+      if (data.status === "error") throw new Error(data.error);
 
       if (data.result) setResult(data.result);
       else setResult("✅ Prompt sent! Check backend for final result.");
@@ -142,8 +142,20 @@ export default function Dashboard() {
     try {
       const res = await fetch(`${API_BASE_URL}containers/send-emails/${id}`, { method: "POST" });
       if (!res.ok) throw new Error(await res.text());
-      const data = await res.json();
-      alert(`Emails Sent: ${data.sent_in_batch || "N/A"}\nTotal Sent: ${data.total_sent || "N/A"}\nOutput:\n${data.output}`);
+      const { job_id } = await res.json();
+      // The campaign runs as a background job; wait for its final SSE event
+      const job = await new Promise((resolve, reject) => {
+        const source = new EventSource(`${API_BASE_URL}containers/send-emails/jobs/${job_id}/events`);
+        source.addEventListener("done", (e) => {
+          source.close();
+          resolve(JSON.parse(e.data));
+        });
+        source.onerror = () => {
+          source.close();
+          reject(new Error("Lost connection to campaign job"));
+        };
+      });
+      alert(`Campaign ${job.status}\nSent: ${job.sent}\nFailed: ${job.failed}\nDeferred: ${job.deferred}`);
       await fetchStats(id);
       await viewLogs(id, logFilter);
       setErrorMsg("");